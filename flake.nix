@@ -68,6 +68,8 @@
                 pyusb>=1.3.1
                 hid>=1.0.8
                 smbus3>=0.5.5
+                numpy>=2.3.3
+                pyudev>=0.24.3
 
                 black>=25.9.0
                 isort>=6.0.1
@@ -145,6 +147,8 @@
               ++ (with python.pkgs; [
                 pyusb
                 hid
+                numpy
+                pyudev
               ])
               ++ [
                 (python.pkgs.buildPythonPackage rec {
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Sequence
+
+from framebuffer import Colors, FrameBuffer, split_frame
+from led_controller_interface import LEDController
+from metrics import metrics
+from transition import EASINGS, DeviceTransition, TransitionEngine
+from utils import DISABLED_COLOR, RGBColor
+
+logger = logging.getLogger(__name__)
+
+
+class EventLoopThread:
+    def __init__(self, name: str) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self.thread.start()
+
+    def run(self, coroutine: Coroutine[Any, Any, Any]) -> Any:
+        # Blocks the calling thread until the coroutine finished on the loop
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def time(self) -> float:
+        return self.loop.time()
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+class AsyncLEDController(ABC):
+    @property
+    @abstractmethod
+    def device_id(self) -> str:
+        pass
+
+    @abstractmethod
+    async def set_static_color(self, color: RGBColor, timeout: Optional[float] = None) -> None:
+        pass
+
+    @abstractmethod
+    async def set_color(self, colors: Colors, timeout: Optional[float] = None) -> None:
+        pass
+
+    @abstractmethod
+    async def set_zone_color(self, zone: str, colors: Colors, timeout: Optional[float] = None) -> None:
+        pass
+
+    @abstractmethod
+    async def push_frame(self, colors: Colors, deadline: Optional[float] = None) -> bool:
+        pass
+
+    @abstractmethod
+    async def turn_on(self, timeout: Optional[float] = None) -> None:
+        pass
+
+    @abstractmethod
+    async def turn_off(self, timeout: Optional[float] = None) -> None:
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+
+class ExecutorLEDController(AsyncLEDController):
+    def __init__(self, controller: LEDController) -> None:
+        self.controller: LEDController = controller
+        self.led_count: int = controller.led_count
+        # One worker per device keeps its transport access serialized without spawning a thread per call
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"io-{controller.device_id}")
+        self._frame: Optional[Future] = None
+
+    @property
+    def device_id(self) -> str:
+        return self.controller.device_id
+
+    async def set_static_color(self, color: RGBColor, timeout: Optional[float] = None) -> None:
+        await self._run("set_static_color", self.controller.set_static_color, color, timeout=timeout)
+
+    async def set_color(self, colors: Colors, timeout: Optional[float] = None) -> None:
+        await self._run("set_color", self.controller.set_color, colors, timeout=timeout)
+
+    async def set_zone_color(self, zone: str, colors: Colors, timeout: Optional[float] = None) -> None:
+        await self._run("set_zone_color", self.controller.set_zone_color, zone, colors, timeout=timeout)
+
+    async def push_frame(self, colors: Colors, deadline: Optional[float] = None) -> bool:
+        # Frames are latest-wins, a device that is still busy skips the frame instead of queueing it.
+        # The executor future stays pending while the worker runs, even after the awaiting side timed out
+        if self._frame is not None and not self._frame.done():
+            metrics.record_error(self.device_id, "push_frame", "dropped")
+            return False
+
+        timeout = None if deadline is None else deadline - asyncio.get_running_loop().time()
+        if timeout is not None and timeout <= 0:
+            metrics.record_error(self.device_id, "push_frame", "deadline_missed")
+            return False
+
+        self._frame = self._submit("push_frame", self.controller.set_color, colors)
+        try:
+            await self._wait(self._frame, timeout)
+            return True
+        except asyncio.TimeoutError:
+            metrics.record_error(self.device_id, "push_frame", "deadline_missed")
+            return False
+
+    async def turn_on(self, timeout: Optional[float] = None) -> None:
+        await self._run("turn_on", self.controller.turn_on, timeout=timeout)
+
+    async def call(self, operation: str, func: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+        # Runs func(controller, *args) on the device's worker, for operations that are not part of LEDController
+        return await self._run(operation, func, self.controller, *args, timeout=timeout)
+
+    async def turn_off(self, timeout: Optional[float] = None) -> None:
+        await self._run("turn_off", self.controller.turn_off, timeout=timeout)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def _submit(self, operation: str, func: Callable[..., Any], *args: Any) -> Future:
+        def call() -> Any:
+            with metrics.track(self.device_id, operation):
+                return func(*args)
+
+        return self._executor.submit(call)
+
+    async def _run(self, operation: str, func: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+        return await self._wait(self._submit(operation, func, *args), timeout)
+
+    @staticmethod
+    async def _wait(future: Future, timeout: Optional[float]) -> Any:
+        wrapped = asyncio.wrap_future(future)
+        if timeout is None:
+            return await wrapped
+        # On timeout the call is cancelled if it has not started yet, a transfer already in progress completes
+        return await asyncio.wait_for(wrapped, timeout)
+
+
+class AsyncSyncedRGBController:
+    def __init__(self, controllers: Sequence[LEDController], transitions: Optional[TransitionEngine] = None) -> None:
+        self.controllers: List[ExecutorLEDController] = [ExecutorLEDController(c) for c in controllers]
+        self.led_count: int = sum(c.led_count for c in controllers)
+        self.current_color: RGBColor = DISABLED_COLOR
+        self.transitions: TransitionEngine = TransitionEngine() if transitions is None else transitions
+
+    async def set_static_color(self, color: RGBColor, timeout: Optional[float] = None) -> None:
+        await asyncio.gather(*(c.set_static_color(color, timeout) for c in self.controllers))
+        self.current_color = color
+
+    async def set_color(self, colors: Colors, timeout: Optional[float] = None) -> None:
+        await asyncio.gather(*(c.set_color(colors, timeout) for c in self.controllers))
+        if isinstance(colors, tuple):
+            self.current_color = colors
+
+    async def set_zone_color(
+        self, device_id: str, zone: Optional[str], colors: Colors, timeout: Optional[float] = None
+    ) -> None:
+        # Without a zone the colors go to the whole device
+        controller = self._controller(device_id)
+        if zone is None:
+            await controller.set_color(colors, timeout)
+        else:
+            await controller.set_zone_color(zone, colors, timeout)
+
+    async def call_each(
+        self, operation: str, func: Callable[..., Any], *args: Any, timeout: Optional[float] = None
+    ) -> List[Any]:
+        return list(await asyncio.gather(*(c.call(operation, func, *args, timeout=timeout) for c in self.controllers)))
+
+    async def push_frame(self, colors: Colors, deadline: Optional[float] = None) -> Dict[str, bool]:
+        if isinstance(colors, FrameBuffer) and colors.led_count == self.led_count:
+            frames: List[Colors] = list(split_frame(colors, [c.led_count for c in self.controllers]))
+        else:
+            frames = [colors] * len(self.controllers)
+        delivered = await asyncio.gather(*(c.push_frame(f, deadline) for c, f in zip(self.controllers, frames)))
+        return {controller.device_id: ok for controller, ok in zip(self.controllers, delivered)}
+
+    async def turn_on(self, timeout: Optional[float] = None) -> None:
+        await asyncio.gather(*(c.turn_on(timeout) for c in self.controllers))
+
+    async def turn_off(self, timeout: Optional[float] = None) -> None:
+        await asyncio.gather(*(c.turn_off(timeout) for c in self.controllers))
+        self.current_color = DISABLED_COLOR
+
+    async def transition_to(self, color: RGBColor, duration: float, easing: str = "ease_in_out") -> None:
+        if easing not in EASINGS:
+            raise ValueError(f"Unknown easing: {easing}. Valid values: {list(EASINGS)}")
+
+        loop = asyncio.get_running_loop()
+        fade = self.transitions.fade(self.current_color, color, loop.time(), duration, EASINGS[easing])
+        transitions = [self.transitions.device_transition(c.device_id, fade) for c in self.controllers]
+        await asyncio.gather(*(self._run_device(c, t) for c, t in zip(self.controllers, transitions)))
+        self.current_color = color
+
+    @staticmethod
+    async def _run_device(controller: AsyncLEDController, transition: DeviceTransition) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            color = transition.step_color(now)
+            if color is None:
+                break
+            if color != transition.last_color and await controller.push_frame(color, transition.fade.end_time):
+                transition.step_sent(color, now, loop.time())
+            await asyncio.sleep(max(0.0, transition.next_step_time(now) - loop.time()))
+
+        await asyncio.sleep(max(0.0, transition.final_start_time() - loop.time()))
+        final_start = loop.time()
+        await controller.set_static_color(transition.fade.target_color)
+        transition.final_sent(final_start, loop.time())
+        logger.debug("Transition on %s finished after %d steps", controller.device_id, transition.steps)
+
+    def close(self) -> None:
+        for controller in self.controllers:
+            controller.close()
+
+    def _controller(self, device_id: str) -> ExecutorLEDController:
+        for controller in self.controllers:
+            if controller.device_id == device_id:
+                return controller
+        raise ValueError(f"Unknown device: {device_id}. Valid values: {[c.device_id for c in self.controllers]}")
@@ -0,0 +1,257 @@
+import logging
+import subprocess
+import sys
+import threading
+import time
+import wave
+from abc import ABC, abstractmethod
+from typing import IO, Any, Callable, List, Optional, Sequence
+
+from framebuffer import FrameBuffer
+from metrics import metrics
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 1024
+BAND_COUNT = 8
+MIN_FREQUENCY = 40.0
+LATENCY_BUDGET = 0.05
+SAMPLE_WIDTH = 2
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("Audio reactive mode requires numpy")
+
+
+class PCMSource(ABC):
+    def __init__(self, sample_rate: int, channels: int, realtime: bool) -> None:
+        self.sample_rate: int = sample_rate
+        self.channels: int = channels
+        self.realtime: bool = realtime
+
+    @abstractmethod
+    def _read(self, size: int) -> bytes:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def read_block(self, block_size: int) -> Optional[Any]:
+        size = block_size * self.channels * SAMPLE_WIDTH
+        data = self._read(size)
+        if len(data) < size:
+            return None
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0
+        return samples.reshape(-1, self.channels).mean(axis=1)
+
+
+class WavSource(PCMSource):
+    def __init__(self, path: str) -> None:
+        self._wav = wave.open(path, "rb")
+        if self._wav.getsampwidth() != SAMPLE_WIDTH:
+            raise ValueError(f"Only 16-bit PCM WAV files are supported, got {self._wav.getsampwidth() * 8}-bit")
+        super().__init__(self._wav.getframerate(), self._wav.getnchannels(), realtime=False)
+
+    def _read(self, size: int) -> bytes:
+        return self._wav.readframes(size // (self.channels * SAMPLE_WIDTH))
+
+    def close(self) -> None:
+        self._wav.close()
+
+
+class PipeSource(PCMSource):
+    def __init__(self, stream: IO[bytes], sample_rate: int = 44100, channels: int = 2) -> None:
+        super().__init__(sample_rate, channels, realtime=True)
+        self.stream: IO[bytes] = stream
+
+    def _read(self, size: int) -> bytes:
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            chunk = self.stream.read(remaining)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b"".join(chunks)
+
+
+class CaptureSource(PipeSource):
+    def __init__(self, sample_rate: int = 44100, channels: int = 2, device: Optional[str] = None) -> None:
+        command = ["arecord", "-q", "-t", "raw", "-f", "S16_LE", "-r", str(sample_rate), "-c", str(channels)]
+        if device:
+            command += ["-D", device]
+        self._process = subprocess.Popen(command, stdout=subprocess.PIPE)  # pylint: disable=consider-using-with
+        assert self._process.stdout is not None
+        super().__init__(self._process.stdout, sample_rate, channels)
+
+    def close(self) -> None:
+        self._process.terminate()
+        self._process.wait()
+
+
+class SpectrumAnalyzer:
+    ATTACK = 0.6
+    RELEASE = 0.15
+    GAIN_DECAY = 0.995
+
+    def __init__(self, sample_rate: int, block_size: int = BLOCK_SIZE, band_count: int = BAND_COUNT) -> None:
+        _require_numpy()
+        self.block_size: int = block_size
+        self.window = np.hanning(block_size).astype(np.float32)
+
+        # Log-spaced band edges as FFT bin indices, every band gets at least one bin
+        frequencies = np.fft.rfftfreq(block_size, 1.0 / sample_rate)
+        edges = np.geomspace(MIN_FREQUENCY, sample_rate / 2, band_count + 1)
+        bins = np.searchsorted(frequencies, edges)
+        self.band_edges: List[int] = []
+        for i in range(band_count + 1):
+            self.band_edges.append(max(int(bins[i]), self.band_edges[-1] + 1 if self.band_edges else 1))
+        self.band_edges = [min(edge, len(frequencies)) for edge in self.band_edges]
+
+        self.levels = np.zeros(band_count, dtype=np.float32)
+        self.peak = 1e-6
+
+    def analyze(self, block: Any) -> Any:
+        spectrum = np.abs(np.fft.rfft(block * self.window))
+        energies = np.array(
+            [
+                spectrum[start:end].mean() if end > start else 0.0
+                for start, end in zip(self.band_edges, self.band_edges[1:])
+            ],
+            dtype=np.float32,
+        )
+        energies = np.log1p(energies)
+
+        self.peak = max(float(energies.max()), self.peak * self.GAIN_DECAY, 1e-6)
+        target = energies / self.peak
+        rate = np.where(target > self.levels, self.ATTACK, self.RELEASE)
+        self.levels += (target - self.levels) * rate
+        return self.levels
+
+
+class SpectrumRenderer:
+    def __init__(self, views: Sequence[FrameBuffer], band_count: int = BAND_COUNT) -> None:
+        _require_numpy()
+        # Per view: the band every LED shows, its base color and the array sharing the view's memory
+        self._targets = []
+        for view in views:
+            if view.led_count == 0:
+                continue
+            band_index = np.minimum(np.arange(view.led_count) * band_count // view.led_count, band_count - 1)
+            base_colors = self._band_colors(band_count)[band_index]
+            target = np.frombuffer(view.data, dtype=np.uint8).reshape(-1, 3)
+            self._targets.append((band_index, base_colors, target))
+
+    @staticmethod
+    def _band_colors(band_count: int) -> Any:
+        # Bass is red, mids green, treble blue
+        position = np.linspace(0.0, 1.0, band_count, dtype=np.float32)
+        red = np.clip(1.0 - 2.0 * position, 0.0, 1.0)
+        green = 1.0 - np.abs(2.0 * position - 1.0)
+        blue = np.clip(2.0 * position - 1.0, 0.0, 1.0)
+        return np.stack([red, green, blue], axis=1) * 255.0
+
+    def render(self, levels: Any) -> None:
+        for band_index, base_colors, target in self._targets:
+            target[:] = (base_colors * levels[band_index, None]).astype(np.uint8)
+
+
+class LatencyReport:
+    def __init__(self, block_duration: float) -> None:
+        self.block_duration: float = block_duration
+        self.samples: List[float] = []
+
+    def add(self, processing: float) -> None:
+        self.samples.append(processing)
+
+    def summary(self) -> str:
+        if not self.samples:
+            return "no blocks processed"
+        ordered = sorted(self.samples)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        # A sample is audible at the earliest when its whole block has been captured
+        total = [self.block_duration + sample for sample in ordered]
+        over_budget = sum(1 for latency in total if latency > LATENCY_BUDGET)
+        return (
+            f"{len(ordered)} blocks, block {self.block_duration * 1000:.1f} ms, "
+            f"processing+send mean {sum(ordered) / len(ordered) * 1000:.2f} ms, p95 {p95 * 1000:.2f} ms, "
+            f"max {ordered[-1] * 1000:.2f} ms, audio-to-light p95 {(self.block_duration + p95) * 1000:.1f} ms, "
+            f"{over_budget} over the {LATENCY_BUDGET * 1000:.0f} ms budget"
+        )
+
+
+class AudioReactiveEffect:
+    def __init__(
+        self,
+        source: PCMSource,
+        views: Sequence[FrameBuffer],
+        push_frame: Callable[[float], None],
+        block_size: int = BLOCK_SIZE,
+        band_count: int = BAND_COUNT,
+        realtime: Optional[bool] = None,
+    ) -> None:
+        self.source: PCMSource = source
+        # File sources are processed as fast as possible unless asked to play back in real time
+        self.paced: bool = bool(realtime) and not source.realtime
+        # Called with the time budget for delivering the frame, one block, so slow devices skip frames
+        # instead of holding up the audio
+        self.push_frame: Callable[[float], None] = push_frame
+        self.analyzer = SpectrumAnalyzer(source.sample_rate, block_size, band_count)
+        self.renderer = SpectrumRenderer(views, band_count)
+        self.report = LatencyReport(block_size / source.sample_rate)
+        self._stopped = threading.Event()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def run(self) -> LatencyReport:
+        logger.info(
+            "Audio reactive mode started (%d Hz, %d samples per block)",
+            self.source.sample_rate,
+            self.analyzer.block_size,
+        )
+        next_block = time.perf_counter()
+        try:
+            while not self._stopped.is_set():
+                block = self.source.read_block(self.analyzer.block_size)
+                if block is None:
+                    break
+                if self.paced:
+                    next_block += self.report.block_duration
+                    self._stopped.wait(max(0.0, next_block - time.perf_counter()))
+                # Checked again after the blocking read, no frame may be pushed once stop() returned
+                if self._stopped.is_set():
+                    break
+                start = time.perf_counter()
+                self.renderer.render(self.analyzer.analyze(block))
+                self.push_frame(self.report.block_duration)
+                elapsed = time.perf_counter() - start
+                metrics.observe("audio", "block", elapsed)
+                self.report.add(elapsed)
+        finally:
+            self.source.close()
+        logger.info("Audio reactive mode stopped: %s", self.report.summary())
+        return self.report
+
+
+def open_source(spec: str) -> PCMSource:
+    if spec == "capture":
+        return CaptureSource()
+    if spec == "-":
+        return PipeSource(sys.stdin.buffer)
+    return WavSource(spec)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(name)s - %(message)s")
+    # Offline run against a WAV file, rendering into a 40 LED frame without any device attached
+    frame = FrameBuffer(40)
+    effect = AudioReactiveEffect(open_source(sys.argv[1]), [frame], lambda _timeout: None)
+    print(effect.run().summary())
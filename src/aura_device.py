@@ -1,14 +1,19 @@
 import logging
 import time
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from usb.core import Device, USBError, USBTimeoutError
 from usb.core import find as find_device
 from usb.util import dispose_resources
 
 from aura_frame_builder import AuraFrameBuilder, AuraMode, RGBColor
+from aura_transport import AuraTransport, DeferredTransportError, open_aura_transport
+from color_correction import DEFAULT_PROFILE, ColorCorrection, ColorProfile
+from framebuffer import Colors, FrameBuffer, copy_colors, split_frame
 from led_controller_interface import LEDController
-from utils import CommandData, format_hex, normalize_command_data
+from metrics import metrics
+from utils import CommandData, DeviceUnavailableError, format_hex, normalize_command_data
+from zones import Zone, contiguous_zones, find_zone, write_zone
 
 fb = AuraFrameBuilder()
 logger = logging.getLogger(__name__)
@@ -51,20 +56,22 @@ class USBDeviceConnection:
         self.device: Optional[Device] = None
         self.interface: Optional[int] = None
         self.kernel_manager: Optional[KernelDriverManager] = None
+        # Kept after close so reopening does not need a full bus scan
+        self._last_device: Optional[Device] = None
 
     def open(self) -> None:
         if self.device:
             logger.error("Device is already open")
             return
 
-        device = find_device(idVendor=self.vendor_id, idProduct=self.product_id)
-
-        if device is None:
-            raise RuntimeError(f"Device not found (VID:{self.vendor_id:04X} PID:{self.product_id:04X})")
-
-        self.device = device
+        self.device = self._find_device()
         self.kernel_manager = KernelDriverManager(self.device)
-        self.kernel_manager.detach_interfaces()
+        try:
+            self.kernel_manager.detach_interfaces()
+        except USBError:
+            self.device = None
+            self._last_device = None
+            raise
 
         try:
             self.device.set_configuration(1)
@@ -79,33 +86,85 @@ class USBDeviceConnection:
             logger.warning("Device is already closed")
             return
 
-        dispose_resources(self.device)
-        if self.kernel_manager:
-            self.kernel_manager.reattach_interfaces()
-
-        self.device = None
-        self.interface = None
+        try:
+            dispose_resources(self.device)
+            if self.kernel_manager:
+                self.kernel_manager.reattach_interfaces()
+        finally:
+            self.device = None
+            self.interface = None
         logger.debug("Device closed successfully")
 
+    def invalidate(self) -> None:
+        self._last_device = None
+
     def is_open(self) -> bool:
         return self.device is not None
 
     def get_device(self) -> Device:
         if not self.device:
-            raise RuntimeError("Device not opened")
+            raise DeviceUnavailableError("Device not opened")
         return self.device
 
+    def _find_device(self) -> Device:
+        if self._last_device is not None:
+            try:
+                self._last_device.get_active_configuration()
+                return self._last_device
+            except USBError as e:
+                logger.debug("Cached device is gone, rescanning the bus: %s", e)
+                self._last_device = None
 
-class AsusAuraLedDevice(LEDController):
+        device = find_device(idVendor=self.vendor_id, idProduct=self.product_id)
+
+        if device is None:
+            raise DeviceUnavailableError(f"Device not found (VID:{self.vendor_id:04X} PID:{self.product_id:04X})")
+
+        self._last_device = device
+        return device
+
+
+# Connection, transport, frame and the cached mode and power state of every channel belong to the one device
+class AsusAuraLedDevice(LEDController):  # pylint: disable=too-many-instance-attributes
     VENDOR_ID: int = 0x0B05
     PRODUCT_ID: int = 0x19AF
     PACKET_SIZE: int = 65
     DEFAULT_TIMEOUT: int = 1500
+    SEND_RETRIES: int = 1
+    # (effect channel, is_gen2, led count or offset, led count) of every direct color frame
+    DIRECT_CHANNELS: List[Tuple[int, bool, int, int]] = [
+        (0x01, False, 16, 16),
+        (0x10, True, 0x28, 8),
+        (0x11, True, 0x48, 8),
+        (0x12, True, 0x68, 8),
+    ]
+    LED_COUNT: int = sum(channel[3] for channel in DIRECT_CHANNELS)
+    POWER_DEVICES: List[int] = [0, 1]
+    ZONES: List[Zone] = contiguous_zones(
+        [f"channel{channel[0]:02x}" for channel in DIRECT_CHANNELS], [channel[3] for channel in DIRECT_CHANNELS]
+    )
 
     # TODO: Implement real thing
     def set_static_color(self, color: RGBColor) -> None:
         self._set_direct_single_color(color)
 
+    def set_color(self, colors: Colors) -> None:
+        self._enter_direct_mode()
+        self._send_direct_colors(copy_colors(self.frame, colors))
+
+    def zones(self) -> List[Zone]:
+        return self.ZONES
+
+    def set_zone_color(self, zone: str, colors: Colors) -> None:
+        target = find_zone(self.ZONES, zone)
+        view = write_zone(self.frame, target, colors)
+        # Channels that were not in direct mode yet get the whole frame, afterwards only the zone's channel is sent
+        if not self._is_direct_mode():
+            self._enter_direct_mode()
+            self._send_direct_colors(self.frame)
+            return
+        self._send_direct_channel(self.DIRECT_CHANNELS[self.ZONES.index(target)], view)
+
     def turn_off(self) -> None:
         self._send(fb.commit())
         self._send(fb.power_state(0, False))
@@ -114,24 +173,113 @@ class AsusAuraLedDevice(LEDController):
         self._disconnect()
 
     def turn_on(self) -> None:
-        if not self._is_connected():
+        # Compiling a scene only records packets, it must not open the device
+        if self._recording is None and not self._is_connected():
             self._connect()
-        self._send(fb.power_state(0, True))
-        self._send(fb.power_state(1, True))
+        for device_num in self.POWER_DEVICES:
+            self._set_power_state(device_num, True)
 
-    def __init__(self, throttle: bool = False) -> None:
+    def __init__(
+        self, throttle: bool = False, color_profile: ColorProfile = DEFAULT_PROFILE, transport: str = "control"
+    ) -> None:
+        self.color_correction: ColorCorrection = ColorCorrection(color_profile)
         self._connection: USBDeviceConnection = USBDeviceConnection(self.VENDOR_ID, self.PRODUCT_ID)
+        self._transport_kind: str = transport
+        self._transport: Optional[AuraTransport] = None
         self._throttle: bool = throttle
+        # Last mode and power state sent to the controller, a missing entry means unknown and is always sent
+        self._channel_modes: Dict[int, AuraMode] = {}
+        self._power_states: Dict[int, bool] = {}
+        self.led_count: int = self.LED_COUNT
+        self.frame: FrameBuffer = FrameBuffer(self.LED_COUNT)
+        self._recording: Optional[List[bytes]] = None
+
+    @property
+    def device_id(self) -> str:
+        return f"aura-{self.VENDOR_ID:04x}:{self.PRODUCT_ID:04x}"
+
+    def scene_key(self) -> Optional[str]:
+        correction = self.color_correction
+        return f"{self.device_id}|{correction.profile}|{correction.channel_order}|{self._get_scene_state().hex()}"
+
+    def compile_static_color(self, color: RGBColor) -> Tuple[List[bytes], bytes]:
+        state = self._get_scene_state()
+        self._recording = []
+        try:
+            self.set_static_color(color)
+            return self._recording, self._get_scene_state()
+        finally:
+            self._recording = None
+            self._set_scene_state(state)
+
+    def replay_static_color(self, color: RGBColor, packets: List[bytes], state: bytes) -> None:
+        if not self._is_connected():
+            self._connect()
+        for packet in packets:
+            self._send(packet)
+        self._set_scene_state(state)
+        self.frame.fill(color)
+
+    def _get_scene_state(self) -> bytes:
+        state = bytearray()
+        for channel, _, _, _ in self.DIRECT_CHANNELS:
+            mode = self._channel_modes.get(channel)
+            state += bytes([mode is not None, 0 if mode is None else mode])
+        for device_num in self.POWER_DEVICES:
+            power = self._power_states.get(device_num)
+            state += bytes([power is not None, bool(power)])
+        return bytes(state)
+
+    def _set_scene_state(self, state: bytes) -> None:
+        self._reset_state()
+        for i, (channel, _, _, _) in enumerate(self.DIRECT_CHANNELS):
+            if state[i * 2]:
+                self._channel_modes[channel] = AuraMode.from_value(state[i * 2 + 1])
+        offset = len(self.DIRECT_CHANNELS) * 2
+        for i, device_num in enumerate(self.POWER_DEVICES):
+            if state[offset + i * 2]:
+                self._power_states[device_num] = bool(state[offset + i * 2 + 1])
+
+    def _reset_state(self) -> None:
+        self._channel_modes = {}
+        self._power_states = {}
+
+    def reconnect(self) -> None:
+        if self._is_connected():
+            try:
+                self._disconnect()
+            except Exception as e:
+                logger.debug("Error closing stale connection: %s", e)
+            self._connection.invalidate()
+        self._connect()
 
     def _connect(self) -> None:
+        self._reset_state()
         self._connection.open()
+        try:
+            self._transport = open_aura_transport(
+                self._connection.get_device(), self._transport_kind, self.DEFAULT_TIMEOUT
+            )
+        except Exception:
+            self._connection.close()
+            raise
 
     def _disconnect(self) -> None:
-        self._connection.close()
+        self._reset_state()
+        try:
+            if self._transport is not None:
+                self._transport.close()
+        finally:
+            self._transport = None
+            self._connection.close()
 
     def _send(self, command_data: CommandData, command_id: Optional[int] = None) -> int:
-        if not self._connection.is_open():
-            raise RuntimeError("Device not opened")
+        if self._recording is not None:
+            data = normalize_command_data(command_data, self.PACKET_SIZE)
+            self._recording.append(data)
+            return len(data)
+        if not self._connection.is_open() or self._transport is None:
+            raise DeviceUnavailableError("Device not opened")
         try:
             data = normalize_command_data(command_data, self.PACKET_SIZE)
             if command_id is not None:
@@ -139,18 +287,17 @@ class AsusAuraLedDevice(LEDController):
             else:
                 logger.debug("Sending command: %s", format_hex(data))
 
-            read_bytes = self._connection.get_device().ctrl_transfer(
-                bmRequestType=0x21,
-                bRequest=0x09,
-                wValue=0x02EC,
-                wIndex=2,
-                data_or_wLength=data,
-                timeout=self.DEFAULT_TIMEOUT,
-            )
+            read_bytes = self._send_packet(self._transport, data)
             if self._throttle:
+                self._transport.flush()
                 time.sleep(1.0)
             return read_bytes
 
+        except DeferredTransportError as e:
+            # Modes and power states sent since the failed frame may have been dropped, none of the cache is trusted
+            self._reset_state()
+            logger.error("Earlier command failed, device state is unknown: %s", e.error)
+            raise
         except USBTimeoutError:
             logger.error("USB timeout during command send")
             raise
@@ -158,6 +305,21 @@ class AsusAuraLedDevice(LEDController):
             logger.error("Error sending command: %s", e)
             raise
 
+    def _send_packet(self, transport: AuraTransport, data: bytes) -> int:
+        # Every packet carries its complete state, so a packet that timed out can be sent again as is.
+        # Deferred errors of queued frames are not retried, they belong to a frame that was already dropped
+        attempt = 0
+        while True:
+            try:
+                with metrics.track(self.device_id, "send", len(data)):
+                    return transport.send(data)
+            except USBTimeoutError as e:
+                if attempt >= self.SEND_RETRIES:
+                    raise
+                attempt += 1
+                metrics.record_retry(self.device_id, "send")
+                logger.debug("Retrying send after USB timeout (%d/%d): %s", attempt, self.SEND_RETRIES, e)
+
     def _is_connected(self) -> bool:
         return self._connection.is_open()
 
@@ -165,18 +327,45 @@ class AsusAuraLedDevice(LEDController):
         self._throttle = not self._throttle
 
     def _set_direct_single_color(self, color: RGBColor):
+        self._enter_direct_mode()
+        self.frame.fill(color)
+        self._send_direct_colors(self.frame)
+
+    def _enter_direct_mode(self) -> None:
+        if self._is_direct_mode():
+            return
+
         self._send(fb.commit())
         self.turn_on()
 
-        self._send(fb.effect_mode(0x01, AuraMode.DIRECT, False))
-        self._send(fb.effect_mode(0x10, AuraMode.DIRECT, False))
-        self._send(fb.effect_mode(0x11, AuraMode.DIRECT, False))
-        self._send(fb.effect_mode(0x12, AuraMode.DIRECT, False))
+        for channel, _, _, _ in self.DIRECT_CHANNELS:
+            self._set_effect_mode(channel, AuraMode.DIRECT)
+
+    def _is_direct_mode(self) -> bool:
+        return all(self._power_states.get(device_num) for device_num in self.POWER_DEVICES) and all(
+            self._channel_modes.get(channel) == AuraMode.DIRECT for channel, _, _, _ in self.DIRECT_CHANNELS
+        )
+
+    def _set_power_state(self, device_num: int, is_on: bool) -> None:
+        if self._power_states.get(device_num) == is_on:
+            return
+        self._send(fb.power_state(device_num, is_on))
+        self._power_states[device_num] = is_on
+
+    def _set_effect_mode(self, channel: int, mode: AuraMode) -> None:
+        if self._channel_modes.get(channel) == mode:
+            return
+        self._send(fb.effect_mode(channel, mode, False))
+        self._channel_modes[channel] = mode
+
+    def _send_direct_colors(self, frame: FrameBuffer) -> None:
+        views = split_frame(frame, [channel[3] for channel in self.DIRECT_CHANNELS])
+        for channel, view in zip(self.DIRECT_CHANNELS, views):
+            self._send_direct_channel(channel, view)
 
-        self._send(fb.direct_mode_single_color(False, 16, color))
-        self._send(fb.direct_mode_single_color(True, 0x28, color, 8))
-        self._send(fb.direct_mode_single_color(True, 0x48, color, 8))
-        self._send(fb.direct_mode_single_color(True, 0x68, color, 8))
+    def _send_direct_channel(self, channel: Tuple[int, bool, int, int], view: FrameBuffer) -> None:
+        _, is_gen2, led_count_or_offset, _ = channel
+        self._send(fb.create_aura_direct_mode_frame(is_gen2, led_count_or_offset, view, self.color_correction))
 
     def _execute_test_sequence(self) -> None:
         try:
@@ -1,6 +1,8 @@
 from enum import IntEnum
 from typing import Optional
 
+from color_correction import IDENTITY_CORRECTION, ColorCorrection
+from framebuffer import FrameBuffer
 from utils import RGBColor
 
 
@@ -45,16 +47,13 @@ class AuraFrameBuilder:
         pass
 
     def _create_base_frame(self, command, data=None):
-        if data is None:
-            data = []
+        buffer = bytearray(self.FRAME_LENGTH)
+        buffer[0] = self.HEADER
+        buffer[1] = command
 
-        buffer = bytearray([self.HEADER, command] + data)
-
-        while len(buffer) < self.FRAME_LENGTH:
-            buffer.append(0x00)
-
-        if len(buffer) > self.FRAME_LENGTH:
-            buffer = buffer[: self.FRAME_LENGTH]
+        if data:
+            data = data[: self.FRAME_LENGTH - 2]
+            buffer[2 : 2 + len(data)] = bytes(data)
 
         return buffer
 
@@ -102,21 +101,30 @@ class AuraFrameBuilder:
 
         return self._create_base_frame(0x36, frame_data)
 
-    def create_aura_direct_mode_frame(self, is_gen2: bool, led_count_or_offset: int, rgb_colors: list[RGBColor]):
+    def create_aura_direct_mode_frame(
+        self,
+        is_gen2: bool,
+        led_count_or_offset: int,
+        rgb_colors: list[RGBColor] | FrameBuffer,
+        color_correction: ColorCorrection = IDENTITY_CORRECTION,
+    ):
         protocol_byte = 0x80 if is_gen2 else 0x81
 
-        rgb_data = []
-        for r, g, b in rgb_colors:
-            r = max(0, min(255, r))
-            g = max(0, min(255, g))
-            b = max(0, min(255, b))
-            rgb_data.extend([r, g, b])
+        if isinstance(rgb_colors, FrameBuffer):
+            rgb_data = color_correction.apply(rgb_colors.data)
+        else:
+            rgb_data = color_correction.apply_colors(rgb_colors)
 
-        frame_data = [protocol_byte, 0x00, led_count_or_offset] + rgb_data
+        frame_data = bytes([protocol_byte, 0x00, led_count_or_offset]) + rgb_data
         return self._create_base_frame(0x40, frame_data)
 
     def direct_mode_single_color(
-        self, is_gen2: bool, led_count_or_offset: int, color: RGBColor, num_leds: Optional[int] = None
+        self,
+        is_gen2: bool,
+        led_count_or_offset: int,
+        color: RGBColor,
+        num_leds: Optional[int] = None,
+        color_correction: ColorCorrection = IDENTITY_CORRECTION,
     ):
         if is_gen2:
             if num_leds is None:
@@ -125,8 +133,9 @@ class AuraFrameBuilder:
         else:
             count = led_count_or_offset
 
-        color_list = [color] * count
-        return self.create_aura_direct_mode_frame(is_gen2, led_count_or_offset, color_list)
+        return self.create_aura_direct_mode_frame(
+            is_gen2, led_count_or_offset, FrameBuffer.filled(count, color), color_correction
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,158 @@
+import logging
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+from usb.core import Device
+from usb.util import ENDPOINT_OUT, endpoint_direction, find_descriptor
+
+logger = logging.getLogger(__name__)
+
+AURA_INTERFACE = 2
+MAX_FRAMES_IN_FLIGHT = 4
+
+
+class DeferredTransportError(OSError):
+    # Raised by send() for an earlier frame that failed after send() returned, frames queued behind it were dropped
+    def __init__(self, error: Exception) -> None:
+        super().__init__(f"Queued frame failed: {error}")
+        self.error: Exception = error
+
+
+class AuraTransport(ABC):
+    @abstractmethod
+    def send(self, data: bytes) -> int:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class ControlTransport(AuraTransport):
+    def __init__(self, device: Device, timeout: int) -> None:
+        self.device: Device = device
+        self.timeout: int = timeout
+
+    def send(self, data: bytes) -> int:
+        return self.device.ctrl_transfer(
+            bmRequestType=0x21,
+            bRequest=0x09,
+            wValue=0x02EC,
+            wIndex=AURA_INTERFACE,
+            data_or_wLength=data,
+            timeout=self.timeout,
+        )
+
+
+class InterruptTransport(AuraTransport):
+    def __init__(self, endpoint: Any, timeout: int, max_in_flight: int = MAX_FRAMES_IN_FLIGHT) -> None:
+        self.endpoint: Any = endpoint
+        self.timeout: int = timeout
+        # pyusb has no asynchronous submission, a writer thread drains a bounded queue so frames stay ordered
+        # and the caller only blocks once max_in_flight frames are waiting
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=max_in_flight)
+        self._error: Optional[Exception] = None
+        self._thread = threading.Thread(target=self._write_frames, name="aura-interrupt-out", daemon=True)
+        self._thread.start()
+
+    def send(self, data: bytes) -> int:
+        self._raise_error()
+        self._queue.put(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        self._queue.join()
+        self._raise_error()
+
+    def close(self) -> None:
+        self._queue.join()
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            logger.warning("Discarding failed interrupt transfer on close: %s", self._error)
+            self._error = None
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise DeferredTransportError(error) from error
+
+    def _write_frames(self) -> None:
+        while True:
+            data = self._queue.get()
+            try:
+                if data is None:
+                    return
+                # Frames queued behind a failed transfer are dropped, the error is raised on the next send or flush
+                if self._error is None:
+                    self.endpoint.write(data, self.timeout)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+
+def find_out_endpoint(device: Device, interface_number: int = AURA_INTERFACE) -> Any:
+    interface = device.get_active_configuration()[(interface_number, 0)]
+    return find_descriptor(
+        interface, custom_match=lambda endpoint: endpoint_direction(endpoint.bEndpointAddress) == ENDPOINT_OUT
+    )
+
+
+def open_aura_transport(device: Device, kind: str, timeout: int) -> AuraTransport:
+    if kind == "interrupt":
+        endpoint = find_out_endpoint(device)
+        if endpoint is not None:
+            logger.debug("Using interrupt OUT endpoint 0x%02x", endpoint.bEndpointAddress)
+            return InterruptTransport(endpoint, timeout)
+        logger.warning("No interrupt OUT endpoint on interface %d, falling back to control transfers", AURA_INTERFACE)
+    elif kind != "control":
+        raise ValueError(f"Unknown Aura transport: {kind}. Valid values: ['control', 'interrupt']")
+
+    return ControlTransport(device, timeout)
+
+
+if __name__ == "__main__":
+    # Benchmark against a simulated device: a control SET_REPORT pays for its setup, data and status stages
+    # plus the firmware's handling before the status ACK, an interrupt OUT report is accepted once per bInterval
+    CONTROL_ROUND_TRIP = 0.004
+    INTERRUPT_INTERVAL = 0.001
+    FRAME_PREPARE_TIME = 0.001
+    FRAMES = 400
+
+    class SimulatedDevice:
+        def ctrl_transfer(self, **kwargs: Any) -> int:
+            time.sleep(CONTROL_ROUND_TRIP)
+            return len(kwargs["data_or_wLength"])
+
+    class SimulatedEndpoint:
+        bEndpointAddress = 0x05
+
+        def write(self, data: bytes, _timeout: int) -> int:
+            time.sleep(INTERRUPT_INTERVAL)
+            return len(data)
+
+    frame = bytes([0xEC, 0x40]) + bytes(63)
+    for name, transport in [
+        ("control", ControlTransport(SimulatedDevice(), 1500)),
+        ("interrupt", InterruptTransport(SimulatedEndpoint(), 1500)),
+    ]:
+        blocked = 0.0
+        start = time.perf_counter()
+        for _ in range(FRAMES):
+            time.sleep(FRAME_PREPARE_TIME)
+            send_start = time.perf_counter()
+            transport.send(frame)
+            blocked += time.perf_counter() - send_start
+        transport.flush()
+        elapsed = time.perf_counter() - start
+        transport.close()
+        print(
+            f"{name:>9}: {FRAMES / elapsed:7.1f} frames/s, "
+            f"caller blocked {blocked / FRAMES * 1000:.2f} ms per frame, total {elapsed:.2f} s"
+        )
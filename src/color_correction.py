@@ -0,0 +1,54 @@
+from itertools import chain
+from typing import Iterable, NamedTuple, Tuple
+
+from utils import RGBColor
+
+CHANNELS = "RGB"
+
+
+class ColorProfile(NamedTuple):
+    gamma: float = 1.0
+    white_point: RGBColor = (255, 255, 255)
+    brightness: float = 1.0
+
+
+DEFAULT_PROFILE = ColorProfile()
+
+
+def _build_table(gamma: float, scale: float) -> bytes:
+    return bytes(min(255, max(0, round(((value / 255) ** gamma) * scale * 255))) for value in range(256))
+
+
+class ColorCorrection:
+    def __init__(self, profile: ColorProfile = DEFAULT_PROFILE, channel_order: str = CHANNELS) -> None:
+        if sorted(channel_order) != sorted(CHANNELS):
+            raise ValueError(f"Invalid channel order: {channel_order}")
+
+        self.profile: ColorProfile = profile
+        self.channel_order: str = channel_order
+        # Source channel index for every output position, e.g. "RBG" -> (0, 2, 1)
+        self._order: Tuple[int, ...] = tuple(CHANNELS.index(channel) for channel in channel_order)
+        self._tables: Tuple[bytes, ...] = tuple(
+            _build_table(profile.gamma, profile.white_point[i] / 255 * profile.brightness) for i in range(3)
+        )
+        identity_table = bytes(range(256))
+        self.is_identity: bool = channel_order == CHANNELS and all(t == identity_table for t in self._tables)
+
+    def apply(self, rgb_data: bytes | bytearray | memoryview) -> bytes:
+        if self.is_identity:
+            return bytes(rgb_data)
+
+        source = bytes(rgb_data)
+        if len(source) % 3:
+            raise ValueError(f"RGB data length must be a multiple of 3, got {len(source)}")
+
+        output = bytearray(len(source))
+        for position, channel in enumerate(self._order):
+            output[position::3] = source[channel::3].translate(self._tables[channel])
+        return bytes(output)
+
+    def apply_colors(self, colors: Iterable[RGBColor]) -> bytes:
+        return self.apply(bytes(chain.from_iterable(colors)))
+
+
+IDENTITY_CORRECTION = ColorCorrection()
@@ -1,14 +1,24 @@
 import logging
-import threading
 import time
 from enum import IntEnum
-from itertools import chain
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 import hid
 
+from color_correction import DEFAULT_PROFILE, ColorCorrection, ColorProfile
+from framebuffer import Colors, FrameBuffer, copy_colors
 from led_controller_interface import LEDController
-from utils import DEFAULT_COLOR, DISABLED_COLOR, CommandData, RGBColor, format_hex, normalize_command_data
+from metrics import metrics
+from utils import (
+    DEFAULT_COLOR,
+    DISABLED_COLOR,
+    CommandData,
+    DeviceUnavailableError,
+    RGBColor,
+    format_hex,
+    normalize_command_data,
+)
+from zones import Zone, contiguous_zones, find_zone, write_zone
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +39,9 @@ class CommandId(IntEnum):
     READ_LED_AUTODETECTION_RESULTS = 0x3D
 
 
+COMMAND_NAMES = {command.value: command.name.lower() for command in CommandId}
+
+
 class RGBChannel(IntEnum):
     RED = 0x00
     GREEN = 0x01
@@ -72,19 +85,54 @@ class CorsairLightingNodeController(LEDController):
     WRITE_PACKET_SIZE = 65
     READ_PACKET_SIZE = 17
     READ_TIMEOUT = 15
+    READ_RETRIES = 1
     LED_COUNT = 4 * 8
     CHANNEL = 0
+    KEEPALIVE_INTERVAL = 5.0
+    FAN_COUNT = 4
+    ZONES = contiguous_zones([f"fan{i + 1}" for i in range(FAN_COUNT)], [LED_COUNT // FAN_COUNT] * FAN_COUNT)
 
-    def __init__(self) -> None:
+    def __init__(self, color_profile: ColorProfile = DEFAULT_PROFILE) -> None:
+        self.color_correction: ColorCorrection = ColorCorrection(color_profile)
         self.device: Optional[hid.Device] = None
         self.working_mode: ChannelMode = ChannelMode.DISABLED
-        self.keepalive_thread: Optional[threading.Thread] = None
-        self.keepalive_running = False
-        self.last_commit_time = time.time()
-        self.lock = threading.Lock()
+        self.led_count: int = self.LED_COUNT
+        self.frame: FrameBuffer = FrameBuffer(self.LED_COUNT)
+        self.last_commit_time = time.monotonic()
+        self._recording: Optional[List[bytes]] = None
+
+    @property
+    def device_id(self) -> str:
+        return f"corsair-{self.VENDOR_ID:04x}:{self.PRODUCT_ID:04x}"
 
     def set_static_color(self, color: RGBColor):
         self._apply_led_mode(LEDMode.FIXED, [color])
+        # The frame mirrors what is shown, so a later zone update can switch to software mode without gaps
+        self.frame.fill(color)
+
+    def set_color(self, colors: Colors) -> None:
+        color_data = self.color_correction.apply(copy_colors(self.frame, colors).data)
+
+        self._switch_to_software_mode()
+        for channel in RGBChannel:
+            self._write_led_color_values(0, self.LED_COUNT, channel, color_data[channel::3])
+        self._write_led_trigger()
+
+    def zones(self) -> List[Zone]:
+        return self.ZONES
+
+    def set_zone_color(self, zone: str, colors: Colors) -> None:
+        target = find_zone(self.ZONES, zone)
+        view = write_zone(self.frame, target, colors)
+        # Leaving hardware mode needs the whole strip, in software mode only the fan's range is written
+        if self.working_mode is not ChannelMode.SOFTWARE:
+            self.set_color(self.frame)
+            return
+
+        color_data = self.color_correction.apply(view.data)
+        for channel in RGBChannel:
+            self._write_led_color_values(target.start, target.led_count, channel, color_data[channel::3])
+        self._write_led_trigger()
 
     def turn_on(self) -> None:
         self._connect()
@@ -99,10 +147,48 @@ class CorsairLightingNodeController(LEDController):
     def set_rainbow_effect(self, speed: LEDSpeed):
         self._apply_led_mode(LEDMode.RAINBOW, None, speed)
 
+    def reconnect(self) -> None:
+        self._disconnect()
+        self._connect()
+
+    def keepalive_due(self) -> Optional[float]:
+        # Software mode falls back to the hardware effect when no trigger arrives for a few seconds
+        if self.device is None or self.working_mode is not ChannelMode.SOFTWARE:
+            return None
+        return self.last_commit_time + self.KEEPALIVE_INTERVAL - time.monotonic()
+
+    def keepalive(self) -> None:
+        self._write_led_trigger()
+
+    def scene_key(self) -> Optional[str]:
+        return f"{self.device_id}|{self.color_correction.profile}|mode={self.working_mode}"
+
+    def compile_static_color(self, color: RGBColor) -> Tuple[List[bytes], bytes]:
+        working_mode = self.working_mode
+        self._recording = []
+        try:
+            self.set_static_color(color)
+            return self._recording, bytes([self.working_mode])
+        finally:
+            self._recording = None
+            self.working_mode = working_mode
+
+    def replay_static_color(self, color: RGBColor, packets: List[bytes], state: bytes) -> None:
+        if not self.device:
+            self._connect()
+        for packet in packets:
+            self._send_command(packet)
+        self.working_mode = ChannelMode(state[0])
+        self.last_commit_time = time.monotonic()
+        self.frame.fill(color)
+
     def _connect(self) -> None:
         try:
             self.device = hid.Device(vid=self.VENDOR_ID, pid=self.PRODUCT_ID)
             logger.info("Connected to CORSAIR Lighting Node CORE")
+        except hid.HIDException as hid_err:
+            logger.error("Failed to connect to CORSAIR Lighting Node CORE: %s", hid_err)
+            raise OSError(str(hid_err)) from hid_err
         except OSError as os_err:
             logger.error(
                 "Failed to connect to CORSAIR Lighting Node CORE - device not found or access denied: %s", os_err
@@ -120,28 +206,49 @@ class CorsairLightingNodeController(LEDController):
                 logger.warning("Error closing device (may already be closed): %s", e)
             finally:
                 self.device = None
+                self.working_mode = ChannelMode.DISABLED
 
         logger.info("CORSAIR Lighting Node CORE disconnected")
 
     def _send_command(self, command_data: CommandData) -> int | bytes:
+        if self._recording is not None:
+            # Stored without the report id, it is added back when the packet is replayed
+            self._recording.append(normalize_command_data(command_data, self.WRITE_PACKET_SIZE - 1))
+            return b""
         if not self.device:
-            raise RuntimeError("Device not opened")
+            raise DeviceUnavailableError("Device not opened")
         try:
             data = normalize_command_data(command_data, self.WRITE_PACKET_SIZE, [0x00])
+            operation = COMMAND_NAMES.get(data[1], "unknown")
             logger.debug("Sending command: %s", format_hex(data))
 
-            bytes_written = self.device.write(data)
-            if bytes_written == 0:
-                raise OSError("Failed to write data to device")
+            with metrics.track(self.device_id, operation, len(data)):
+                bytes_written = self.device.write(data)
+                if bytes_written == 0:
+                    raise OSError("Failed to write data to device")
 
             try:
-                response = self.device.read(self.READ_PACKET_SIZE, timeout=self.READ_TIMEOUT)
-                if not response and command_data[0] != CommandId.WRITE_LED_GROUPS_CLEAR:
+                expects_response = command_data[0] != CommandId.WRITE_LED_GROUPS_CLEAR
+                with metrics.track(self.device_id, "read_response"):
+                    response = self.device.read(self.READ_PACKET_SIZE, timeout=self.READ_TIMEOUT)
+                retries = 0
+                while not response and expects_response and retries < self.READ_RETRIES:
+                    # A late response is picked up by reading again, the command itself is not repeated
+                    retries += 1
+                    metrics.record_retry(self.device_id, "read_response")
+                    with metrics.track(self.device_id, "read_response"):
+                        response = self.device.read(self.READ_PACKET_SIZE, timeout=self.READ_TIMEOUT)
+                if not response and expects_response:
                     logger.warning("Device returned empty response (CommandID: 0x%02X)", command_data[0])
+                    metrics.record_error(self.device_id, operation, "empty_response")
                 return response
             except OSError as e:
                 logger.error("Failed to read from device: %s", e)
                 raise
+        except hid.HIDException as e:
+            # Surfaced as OSError like every other transport failure, so the supervisor can reconnect
+            logger.error("Error sending command: %s", e)
+            raise OSError(str(e)) from e
         except Exception as e:
             logger.error("Error sending command: %s", e)
             raise
@@ -175,6 +282,7 @@ class CorsairLightingNodeController(LEDController):
 
     def _write_led_mode(self, mode: ChannelMode):
         self._send_command([CommandId.WRITE_LED_MODE, self.CHANNEL, mode])
+        self.working_mode = mode
 
     def _write_led_group_set(
         self,
@@ -203,16 +311,18 @@ class CorsairLightingNodeController(LEDController):
                 direction,
                 random_colors,
                 0xFF,
-                *chain.from_iterable(colors),
+                *self.color_correction.apply_colors(colors),
             ]
         )
         logger.debug("RESPONSE WRITE_LED_GROUP_SET: %s", format_hex(response))
 
     def _write_led_trigger(self) -> None:
         self._send_command([CommandId.WRITE_LED_TRIGGER, 0xFF])
-        self.last_commit_time = time.time()
+        self.last_commit_time = time.monotonic()
 
-    def _write_led_color_values(self, start: int, count: int, color_channel: RGBChannel, color_data: List[int]) -> None:
+    def _write_led_color_values(
+        self, start: int, count: int, color_channel: RGBChannel, color_data: List[int] | bytes
+    ) -> None:
         if start < 0 or count <= 0 or start + count > self.LED_COUNT:
             raise ValueError(f"Invalid LED range: start={start}, count={count}, max={self.LED_COUNT}")
 
@@ -1,3 +1,6 @@
+from color_correction import ColorProfile
+from utils import DEFAULT_COLOR, DISABLED_COLOR
+
 GPU_BUS_NUMBER = 9
 GPU_BUS_ADDRESS = 0x67
 GPU_DEVICE_NAME = "AUMA0-E6K5-1113"
@@ -5,3 +8,25 @@ RAM_BUS_NUMBER = 6
 RAM_DEVICE_NAME = "AUDA0-E6K5-0101"
 RAM1_BUS_ADDRESS = 0x71
 RAM2_BUS_ADDRESS = 0x73
+# Batch ENE register access into single I2C_RDWR ioctls, falls back to SMBus when the adapter lacks plain I2C
+ENE_USE_I2C_RDWR = False
+# "control" sends Aura frames as SET_REPORT control transfers, "interrupt" queues them on the interrupt OUT endpoint
+AURA_TRANSPORT = "control"
+METRICS_TEXTFILE_PATH = "/run/my-pc-rgb/metrics.prom"
+METRICS_EXPORT_INTERVAL = 10.0
+# Audio reactive mode: None disables it, "capture" records through arecord, "-" reads s16le PCM from stdin,
+# anything else is a WAV file path
+AUDIO_SOURCE = None
+
+# Per-device color correction so colors match across RAM, GPU, fans and the cooler
+RAM_COLOR_PROFILE = ColorProfile(gamma=1.0, white_point=(255, 255, 255), brightness=1.0)
+GPU_COLOR_PROFILE = ColorProfile(gamma=1.0, white_point=(255, 255, 255), brightness=1.0)
+CORSAIR_COLOR_PROFILE = ColorProfile(gamma=1.0, white_point=(255, 255, 255), brightness=1.0)
+AURA_COLOR_PROFILE = ColorProfile(gamma=1.0, white_point=(255, 255, 255), brightness=1.0)
+
+SCENE_CACHE_DIR = "/var/cache/my-pc-rgb/scenes"
+DEFAULT_SCENE = "default"
+SCENES = {
+    "default": DEFAULT_COLOR,
+    "off": DISABLED_COLOR,
+}
@@ -0,0 +1,287 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from framebuffer import Colors
+from led_controller_interface import LEDController
+from metrics import metrics
+from utils import DeviceUnavailableError, RGBColor
+from zones import Zone, find_zone
+
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+logger = logging.getLogger(__name__)
+
+UsbId = Tuple[int, int]
+# Failures of the device or its connection, anything else is a caller error and does not take the device offline
+TRANSPORT_ERRORS = (OSError, DeviceUnavailableError)
+
+
+class HotplugMonitor:
+    def __init__(self) -> None:
+        self._subscribers: Dict[UsbId, List[Callable[[], None]]] = {}
+        self._lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def is_available() -> bool:
+        return pyudev is not None
+
+    def subscribe(self, usb_id: UsbId, callback: Callable[[], None]) -> None:
+        with self._lock:
+            self._subscribers.setdefault(usb_id, []).append(callback)
+
+    def start(self) -> None:
+        if self.thread or not self.is_available():
+            if not self.is_available():
+                logger.info("pyudev is not installed, reconnecting on backoff timer only")
+            return
+
+        monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+        monitor.filter_by(subsystem="usb", device_type="usb_device")
+        monitor.start()
+        self.thread = threading.Thread(target=self._run, args=(monitor,), name="hotplug-monitor", daemon=True)
+        self.thread.start()
+
+    def notify(self, usb_id: UsbId) -> None:
+        with self._lock:
+            callbacks = list(self._subscribers.get(usb_id, []))
+        for callback in callbacks:
+            callback()
+
+    def _run(self, monitor: Any) -> None:
+        # Blocks on the netlink socket, there are no wakeups until udev reports an event
+        for device in iter(monitor.poll, None):
+            if device.action != "add":
+                continue
+            try:
+                usb_id = (int(device.get("ID_VENDOR_ID", ""), 16), int(device.get("ID_MODEL_ID", ""), 16))
+            except ValueError:
+                continue
+            logger.debug("USB device %04X:%04X added", *usb_id)
+            self.notify(usb_id)
+
+
+# Besides the wrapped device it keeps what to restore after a reconnect and the reconnect thread's synchronization
+class SupervisedController(LEDController):  # pylint: disable=too-many-instance-attributes
+    def __init__(
+        self,
+        controller: LEDController,
+        hotplug: Optional[HotplugMonitor] = None,
+        usb_id: Optional[UsbId] = None,
+        initial_backoff: float = 0.5,
+        max_backoff: float = 30.0,
+    ) -> None:
+        self.controller: LEDController = controller
+        self.led_count: int = controller.led_count
+        self.initial_backoff: float = initial_backoff
+        self.max_backoff: float = max_backoff
+        self.online = True
+        self.powered = False
+        self._last_color_call: Optional[Tuple[str, Any]] = None
+        # Zone updates made after the last whole-device color, replayed on top of it when restoring
+        self._zone_colors: Dict[str, Colors] = {}
+        self._io_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._reconnect_thread: Optional[threading.Thread] = None
+
+        if hotplug is not None and usb_id is not None:
+            hotplug.subscribe(usb_id, self._wake.set)
+
+    @property
+    def device_id(self) -> str:
+        return self.controller.device_id
+
+    def set_static_color(self, color: RGBColor) -> None:
+        self._last_color_call = ("set_static_color", color)
+        self._zone_colors = {}
+        self._call("set_static_color", color)
+
+    def set_color(self, colors: Colors) -> None:
+        self._last_color_call = ("set_color", colors)
+        self._zone_colors = {}
+        self._call("set_color", colors)
+
+    def zones(self) -> List[Zone]:
+        return self.controller.zones()
+
+    def set_zone_color(self, zone: str, colors: Colors) -> None:
+        # Validated here, an unknown zone must not take the device offline
+        find_zone(self.controller.zones(), zone)
+        self._zone_colors[zone] = colors
+        self._call("set_zone_color", zone, colors)
+
+    def turn_on(self) -> None:
+        self.powered = True
+        self._last_color_call = None
+        self._zone_colors = {}
+        if not self.online:
+            self._go_offline()
+            self._wake.set()
+            return
+        self._call("turn_on")
+
+    def turn_off(self) -> None:
+        self.powered = False
+        self._call("turn_off")
+
+    def reconnect(self) -> None:
+        self._wake.set()
+
+    def keepalive_due(self) -> Optional[float]:
+        return self.controller.keepalive_due() if self.online else None
+
+    def keepalive(self) -> None:
+        self._call("keepalive")
+
+    def scene_key(self) -> Optional[str]:
+        return self.controller.scene_key() if self.online else None
+
+    def compile_static_color(self, color: RGBColor) -> Tuple[List[bytes], bytes]:
+        with self._io_lock:
+            return self.controller.compile_static_color(color)
+
+    def replay_static_color(self, color: RGBColor, packets: List[bytes], state: bytes) -> None:
+        self._last_color_call = ("set_static_color", color)
+        self._zone_colors = {}
+        self._call("replay_static_color", color, packets, state)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+        if self._reconnect_thread:
+            self._reconnect_thread.join()
+            self._reconnect_thread = None
+
+    def _call(self, method: str, *args: Any) -> None:
+        if not self.online:
+            logger.debug("%s is offline, skipping %s", self.device_id, method)
+            return
+
+        with self._io_lock:
+            if not self.online:
+                return
+            try:
+                getattr(self.controller, method)(*args)
+            except TRANSPORT_ERRORS as e:
+                logger.error("%s failed during %s, taking it offline: %s", self.device_id, method, e)
+                self._go_offline()
+
+    def _go_offline(self) -> None:
+        self.online = False
+        if self._reconnect_thread and self._reconnect_thread.is_alive():
+            return
+        self._wake.clear()
+        self._reconnect_thread = threading.Thread(
+            target=self._reconnect_loop, name=f"reconnect-{self.device_id}", daemon=True
+        )
+        self._reconnect_thread.start()
+
+    def _reconnect_loop(self) -> None:
+        backoff = self.initial_backoff
+        while not self._stopped.is_set():
+            # A hotplug event cuts the backoff short
+            self._wake.wait(backoff)
+            self._wake.clear()
+            if self._stopped.is_set():
+                return
+            if not self.powered:
+                logger.info("%s is turned off, stopping reconnect attempts", self.device_id)
+                return
+
+            metrics.record_retry(self.device_id, "reconnect")
+            with self._io_lock:
+                try:
+                    self._restore()
+                except Exception as e:
+                    backoff = min(backoff * 2, self.max_backoff)
+                    logger.warning("Reconnecting %s failed, next attempt in %.1fs: %s", self.device_id, backoff, e)
+                    continue
+                self.online = True
+
+            logger.info("%s reconnected", self.device_id)
+            return
+
+    def _restore(self) -> None:
+        self.controller.reconnect()
+        self.controller.turn_on()
+        if self._last_color_call is not None:
+            method, argument = self._last_color_call
+            getattr(self.controller, method)(argument)
+        for zone, colors in list(self._zone_colors.items()):
+            self.controller.set_zone_color(zone, colors)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(name)s - %(message)s")
+
+    # Fake transport that disconnects on command, to exercise offline handling, backoff and restore
+    class FakeTransport:
+        def __init__(self) -> None:
+            self.connected = True
+            self.writes: List[Any] = []
+
+        def write(self, data: Any) -> None:
+            if not self.connected:
+                raise OSError("Fake transport disconnected")
+            self.writes.append(data)
+
+    class FakeController(LEDController):
+        led_count = 8
+
+        def __init__(self, transport: FakeTransport) -> None:
+            self.transport = transport
+
+        def set_static_color(self, color: RGBColor) -> None:
+            if any(not 0 <= value <= 255 for value in color):
+                raise ValueError(f"Invalid color: {color}")
+            self.transport.write(color)
+
+        def set_color(self, colors: Colors) -> None:
+            self.transport.write(colors)
+
+        def turn_on(self) -> None:
+            self.transport.write("on")
+
+        def turn_off(self) -> None:
+            self.transport.write("off")
+
+        def reconnect(self) -> None:
+            if not self.transport.connected:
+                raise DeviceUnavailableError("Fake device not found")
+
+    fake_usb_id = (0x1234, 0x5678)
+    fake_hotplug = HotplugMonitor()
+    fake_transport = FakeTransport()
+    supervised = SupervisedController(
+        FakeController(fake_transport), fake_hotplug, fake_usb_id, initial_backoff=0.05, max_backoff=0.2
+    )
+    supervised.turn_on()
+
+    try:
+        supervised.set_static_color((300, 0, 0))
+        raise AssertionError("Invalid color was not raised to the caller")
+    except ValueError as error:
+        print(f"Invalid color raised to the caller: {error}")
+    assert supervised.online, "A caller error took the device offline"
+
+    fake_transport.connected = False
+    supervised.set_static_color((0, 255, 0))
+    assert not supervised.online, "A transport error did not take the device offline"
+    print("Disconnected: device is offline")
+    time.sleep(0.5)
+
+    fake_transport.connected = True
+    fake_hotplug.notify(fake_usb_id)
+    deadline = time.monotonic() + 1.0
+    while not supervised.online and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert supervised.online, "Device did not come back after the hotplug event"
+    assert fake_transport.writes[-2:] == ["on", (0, 255, 0)], fake_transport.writes
+    print(f"Reconnected: restored {fake_transport.writes[-2:]}")
+    supervised.stop()
@@ -1,14 +1,18 @@
 import logging
 from enum import IntEnum
-from typing import List, Optional
-
-from smbus3 import SMBus
+from typing import Callable, List, Optional, Tuple, TypeVar
 
+from color_correction import DEFAULT_PROFILE, ColorCorrection, ColorProfile
+from framebuffer import Colors, FrameBuffer, write_colors
+from i2c_transport import ENETransport, RecordingTransport, open_ene_transport, replay_operations
 from led_controller_interface import LEDController
+from metrics import metrics
 from utils import DEFAULT_COLOR, DISABLED_COLOR, RGBColor
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 
 class Config(IntEnum):
     LED_COUNT = 0x03
@@ -34,27 +38,30 @@ class LightMode(IntEnum):
     STATIC = 1
 
 
-class ENEController(LEDController):
-    def set_color(self, colors: RGBColor | List[RGBColor]) -> None:
+# Chip identity, transport, config table and the mode registers last written are all per chip
+class ENEController(LEDController):  # pylint: disable=too-many-instance-attributes
+    CHANNEL_ORDER = "RBG"
+    IO_RETRIES = 2
+
+    def set_color(self, colors: Colors) -> None:
         if isinstance(colors, tuple):
             r, g, b = colors
-            colors_list = [colors] * self.led_count
             self._set_direct_mode(True, colors)
             logger.debug("Set direct color RGB(%d, %d, %d) for %d LEDs", r, g, b, self.led_count)
         else:
-            colors_list = colors
             self._set_direct_mode(True, colors[0])
             logger.debug("Set %d individual colors", len(colors))
 
-        self._write_colors(colors_list)
+        # Mode switches above write through the same buffer, so it is filled only afterwards
+        self._write_colors(write_colors(self.frame, colors))
 
     def set_static_color(self, color: RGBColor) -> None:
         r, g, b = color
-        colors_list = [color] * self.led_count
         self._set_direct_mode(False, color)
         logger.debug("Set static color RGB(%d, %d, %d) for %d LEDs", r, g, b, self.led_count)
 
-        self._write_colors(colors_list)
+        self.frame.fill(color)
+        self._write_colors(self.frame)
 
     def turn_on(self) -> None:
         try:
@@ -77,8 +84,17 @@ class ENEController(LEDController):
             logger.error("Error turning off GPU LED: %s", e)
             raise
 
-    def __init__(self, bus_number: int, address: int, device_name: str) -> None:
-        self.bus: SMBus = SMBus(bus_number)
+    def __init__(
+        self,
+        bus_number: int,
+        address: int,
+        device_name: str,
+        color_profile: ColorProfile = DEFAULT_PROFILE,
+        use_i2c_rdwr: bool = False,
+    ) -> None:
+        self.color_correction: ColorCorrection = ColorCorrection(color_profile, self.CHANNEL_ORDER)
+        self.bus_number: int = bus_number
+        self.transport: ENETransport = open_ene_transport(bus_number, use_i2c_rdwr)
         self.address: int = address
         self.device_name: str = self._get_device_name()
 
@@ -92,15 +108,73 @@ class ENEController(LEDController):
         self.is_direct_mode = False
         self.light_mode = self._read_register(Registers.MODE)
         self.led_count: int = self.config_table[Config.LED_COUNT]
+        self.frame: FrameBuffer = FrameBuffer(self.led_count)
 
         logger.debug("ENE Controller initialized on bus %s at address 0x%02X", bus_number, address)
         logger.info("ENE Controller initialized with %d LEDs", self.led_count)
 
+    @property
+    def device_id(self) -> str:
+        return f"ene-{self.bus_number}-0x{self.address:02x}"
+
+    def scene_key(self) -> Optional[str]:
+        correction = self.color_correction
+        return (
+            f"{self.device_id}|{self.device_name}|{self.led_count}|{correction.profile}|{correction.channel_order}"
+            + f"|{self._get_scene_state().hex()}"
+        )
+
+    def compile_static_color(self, color: RGBColor) -> Tuple[List[bytes], bytes]:
+        state = self._get_scene_state()
+        transport = self.transport
+        recorder = RecordingTransport()
+        self.transport = recorder
+        try:
+            self.set_static_color(color)
+            return recorder.operations, self._get_scene_state()
+        finally:
+            self.transport = transport
+            self._set_scene_state(state)
+
+    def replay_static_color(self, color: RGBColor, packets: List[bytes], state: bytes) -> None:
+        try:
+            self._transfer(
+                "replay",
+                sum(len(packet) + 2 for packet in packets),
+                lambda: replay_operations(self.transport, self.address, packets),
+            )
+        except Exception as e:
+            logger.error("Error replaying scene: %s", e)
+            raise
+        self._set_scene_state(state)
+        self.frame.fill(color)
+
+    def _get_scene_state(self) -> bytes:
+        return bytes([self.is_direct_mode, self.light_mode])
+
+    def _set_scene_state(self, state: bytes) -> None:
+        self.is_direct_mode = bool(state[0])
+        self.light_mode = state[1]
+
+    def _transfer(self, operation: str, bytes_sent: int, transfer: Callable[[], T]) -> T:
+        # Register accesses only set values, so a transfer that failed on a busy bus is safe to repeat
+        attempt = 0
+        while True:
+            try:
+                with metrics.track(self.device_id, operation, bytes_sent):
+                    return transfer()
+            except OSError as e:
+                if attempt >= self.IO_RETRIES:
+                    raise
+                attempt += 1
+                metrics.record_retry(self.device_id, operation)
+                logger.debug("Retrying %s on %s (%d/%d): %s", operation, self.device_id, attempt, self.IO_RETRIES, e)
+
     def _read_register(self, register: int) -> int:
         try:
-            reg_swapped = ((register << 8) & 0xFF00) | ((register >> 8) & 0x00FF)
-            self.bus.write_word_data(self.address, 0x00, reg_swapped)
-            value = self.bus.read_byte_data(self.address, 0x81)
+            value = self._transfer(
+                "read_register", 4, lambda: self.transport.read_registers(self.address, [register])[0]
+            )
             logger.debug("Read 0x%02X from register 0x%04X", value, register)
             return value
         except Exception as e:
@@ -109,7 +183,11 @@ class ENEController(LEDController):
 
     def _read_register_block(self, register: int, length: int) -> List[int]:
         try:
-            data = [self._read_register(register + i) for i in range(length)]
+            data = self._transfer(
+                "read_register_block",
+                4 * length,
+                lambda: self.transport.read_registers(self.address, range(register, register + length)),
+            )
             logger.debug("Read %d bytes from register 0x%04X", len(data), register)
             return data
         except Exception as e:
@@ -118,33 +196,29 @@ class ENEController(LEDController):
 
     def _write_register(self, register: int, value: int) -> None:
         try:
-            reg_swapped = ((register << 8) & 0xFF00) | ((register >> 8) & 0x00FF)
-            self.bus.write_word_data(self.address, 0x00, reg_swapped)
-            self.bus.write_byte_data(self.address, 0x01, value)
+            self._transfer("write_register", 5, lambda: self.transport.write_register(self.address, register, value))
             logger.debug("Wrote 0x%02X to register 0x%04X", value, register)
         except Exception as e:
             logger.error("Error writing to register 0x%04X: %s", register, e)
             raise
 
-    def _write_register_block(self, register: int, data: List[int]) -> None:
+    def _write_register_blocks(self, blocks: List[Tuple[int, bytes]]) -> None:
         try:
-            reg_swapped = ((register << 8) & 0xFF00) | ((register >> 8) & 0x00FF)
-            self.bus.write_word_data(self.address, 0x00, reg_swapped)
-            self.bus.write_block_data(self.address, 0x03, data)
-            logger.debug("Wrote block to register 0x%04X: %s bytes", register, len(data))
+            self._transfer(
+                "write_register_blocks",
+                sum(5 + len(data) for _, data in blocks),
+                lambda: self.transport.write_register_blocks(self.address, blocks),
+            )
+            logger.debug("Wrote %d blocks starting at register 0x%04X", len(blocks), blocks[0][0])
         except Exception as e:
-            logger.error("Error writing block to register 0x%04X: %s", register, e)
+            logger.error("Error writing blocks starting at register 0x%04X: %s", blocks[0][0], e)
             raise
 
-    def _write_colors(self, colors: List[RGBColor]) -> None:
-        color_buf: List[int] = []
-        for r, g, b in colors:
-            color_buf.extend([r, b, g])
+    def _write_colors(self, frame: FrameBuffer) -> None:
+        color_buf = self.color_correction.apply(frame.data)
 
         register = Registers.COLORS_DIRECT_V2 if self.is_direct_mode else Registers.COLORS_EFFECT_V2
-        for i in range(0, len(color_buf), 3):
-            chunk = color_buf[i : i + 3]
-            self._write_register_block(register + i, chunk)
+        self._write_register_blocks([(register + i, color_buf[i : i + 3]) for i in range(0, len(color_buf), 3)])
 
         self.apply()
         if not self.is_direct_mode and self.light_mode == LightMode.STATIC:
@@ -181,7 +255,7 @@ class ENEController(LEDController):
 
     def close(self) -> None:
         try:
-            self.bus.close()
+            self.transport.close()
             logger.debug("ENE Controller closed")
         except Exception as e:
             logger.error("Error closing ENE Controller: %s", e)
@@ -1,33 +1,112 @@
 import logging
 from concurrent.futures import ThreadPoolExecutor
-from typing import Callable, List, Tuple
+from typing import Callable, List, Optional, Tuple
 
+from color_correction import ColorProfile
 from ene_controller import ENEController
+from framebuffer import Colors, FrameBuffer, split_frame
 from led_controller_interface import LEDController
+from metrics import metrics
 from utils import RGBColor
+from zones import Zone, contiguous_zones, find_zone
 
 logger = logging.getLogger(__name__)
 
 
 class ENESyncController(LEDController):
-    def __init__(self, devices: List[Tuple[int, int, str]]) -> None:
+    def __init__(self, devices: List[Tuple[int, int, str, ColorProfile]], use_i2c_rdwr: bool = False) -> None:
         self.devices: List[ENEController] = [
-            ENEController(bus, addr, device_name) for bus, addr, device_name in devices
+            ENEController(bus, addr, device_name, profile, use_i2c_rdwr) for bus, addr, device_name, profile in devices
+        ]
+        self.led_count: int = sum(device.led_count for device in self.devices)
+        # One zone per chip, named after its bus and address
+        self._zones: List[Zone] = contiguous_zones(
+            [device.device_id for device in self.devices], [device.led_count for device in self.devices]
+        )
+        # A persistent worker per chip, so bus access runs in parallel without starting threads on every call
+        self._executors: List[ThreadPoolExecutor] = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"io-{device.device_id}") for device in self.devices
         ]
         logger.info("Sync Controller initialized with %d devices", len(self.devices))
 
-    def _execute(self, func: Callable, *args, **kwargs) -> None:
-        with ThreadPoolExecutor() as executor:
-            list(executor.map(lambda device: func(device, *args, **kwargs), self.devices))
+    @property
+    def device_id(self) -> str:
+        return "ene-sync"
+
+    def _execute(self, operation: str, func: Callable, *args, **kwargs) -> None:
+        self._execute_each(operation, lambda d, _: func(d, *args, **kwargs), [None] * len(self.devices))
+
+    def _execute_each(self, operation: str, func: Callable, args: List) -> None:
+        def run(device: LEDController, arg) -> None:
+            with metrics.track(device.device_id, operation):
+                func(device, arg)
+
+        futures = [
+            executor.submit(run, device, arg) for executor, device, arg in zip(self._executors, self.devices, args)
+        ]
+        for future in futures:
+            future.result()
 
     def set_static_color(self, color: RGBColor) -> None:
-        self._execute(lambda d, c: d.set_static_color(c), color)
+        self._execute("set_static_color", lambda d, c: d.set_static_color(c), color)
+
+    def set_color(self, colors: Colors) -> None:
+        # A frame covering all devices is split into per-device views, anything else is sent to every device
+        if isinstance(colors, FrameBuffer) and colors.led_count == self.led_count:
+            views = split_frame(colors, [device.led_count for device in self.devices])
+            self._execute_each("set_color", lambda d, c: d.set_color(c), views)
+        else:
+            self._execute("set_color", lambda d, c: d.set_color(c), colors)
+
+    def zones(self) -> List[Zone]:
+        return self._zones
 
-    def set_color(self, colors: RGBColor | List[RGBColor]) -> None:
-        self._execute(lambda d, c: d.set_color(c), colors)
+    def set_zone_color(self, zone: str, colors: Colors) -> None:
+        index = self._zones.index(find_zone(self._zones, zone))
+        device = self.devices[index]
+
+        def run() -> None:
+            with metrics.track(device.device_id, "set_color"):
+                device.set_color(colors)
+
+        self._executors[index].submit(run).result()
 
     def turn_on(self) -> None:
-        self._execute(lambda d: d.turn_on())
+        self._execute("turn_on", lambda d: d.turn_on())
 
     def turn_off(self) -> None:
-        self._execute(lambda d: d.turn_off())
+        self._execute("turn_off", lambda d: d.turn_off())
+
+    def scene_key(self) -> Optional[str]:
+        keys = [device.scene_key() for device in self.devices]
+        if any(key is None for key in keys):
+            return None
+        return ";".join(str(key) for key in keys)
+
+    def compile_static_color(self, color: RGBColor) -> Tuple[List[bytes], bytes]:
+        # Packets are prefixed with the index of the device they belong to
+        packets: List[bytes] = []
+        state = b""
+        for index, device in enumerate(self.devices):
+            device_packets, device_state = device.compile_static_color(color)
+            packets.extend(bytes([index]) + packet for packet in device_packets)
+            state += bytes([len(device_state)]) + device_state
+        return packets, state
+
+    def replay_static_color(self, color: RGBColor, packets: List[bytes], state: bytes) -> None:
+        device_packets: List[List[bytes]] = [[] for _ in self.devices]
+        for packet in packets:
+            device_packets[packet[0]].append(packet[1:])
+
+        device_states: List[bytes] = []
+        offset = 0
+        for _ in self.devices:
+            length = state[offset]
+            device_states.append(state[offset + 1 : offset + 1 + length])
+            offset += 1 + length
+
+        self._execute_each(
+            "replay_static_color",
+            lambda d, replay: d.replay_static_color(color, *replay),
+            list(zip(device_packets, device_states)),
+        )
@@ -0,0 +1,87 @@
+from typing import List, Optional, Sequence, TypeAlias
+
+from utils import RGBColor
+
+
+class FrameBuffer:
+    __slots__ = ("led_count", "data")
+
+    def __init__(self, led_count: int, data: Optional[memoryview] = None) -> None:
+        if data is None:
+            data = memoryview(bytearray(led_count * 3))
+        elif len(data) != led_count * 3:
+            raise ValueError(f"Buffer of {len(data)} bytes does not hold {led_count} LEDs")
+        self.led_count: int = led_count
+        self.data: memoryview = data
+
+    @classmethod
+    def filled(cls, led_count: int, color: RGBColor) -> "FrameBuffer":
+        frame = cls(led_count)
+        frame.fill(color)
+        return frame
+
+    @classmethod
+    def from_colors(cls, colors: Sequence[RGBColor]) -> "FrameBuffer":
+        frame = cls(len(colors))
+        for i, color in enumerate(colors):
+            frame[i] = color
+        return frame
+
+    def fill(self, color: RGBColor) -> None:
+        self.data[:] = bytes(color) * self.led_count
+
+    def view(self, start: int, count: int) -> "FrameBuffer":
+        if start < 0 or count < 0 or start + count > self.led_count:
+            raise ValueError(f"Invalid LED range: start={start}, count={count}, max={self.led_count}")
+        return FrameBuffer(count, self.data[start * 3 : (start + count) * 3])
+
+    def colors(self) -> List[RGBColor]:
+        data = self.data
+        return [(data[i], data[i + 1], data[i + 2]) for i in range(0, len(data), 3)]
+
+    def __len__(self) -> int:
+        return self.led_count
+
+    def __getitem__(self, index: int) -> RGBColor:
+        offset = index * 3
+        return self.data[offset], self.data[offset + 1], self.data[offset + 2]
+
+    def __setitem__(self, index: int, color: RGBColor) -> None:
+        offset = index * 3
+        self.data[offset : offset + 3] = bytes(color)
+
+
+Colors: TypeAlias = RGBColor | List[RGBColor] | FrameBuffer
+
+
+def write_colors(frame: FrameBuffer, colors: Colors) -> FrameBuffer:
+    if isinstance(colors, tuple):
+        frame.fill(colors)
+        return frame
+    if isinstance(colors, FrameBuffer):
+        if colors.led_count == frame.led_count:
+            return colors
+        # Like a list, a frame of another size only sets the LEDs both of them have
+        size = min(colors.led_count, frame.led_count) * 3
+        frame.data[:size] = colors.data[:size]
+        return frame
+    for i, color in enumerate(colors[: frame.led_count]):
+        frame[i] = color
+    return frame
+
+
+def copy_colors(frame: FrameBuffer, colors: Colors) -> FrameBuffer:
+    # Like write_colors, but a frame of the right size is copied instead of used in place
+    written = write_colors(frame, colors)
+    if written is not frame:
+        frame.data[:] = written.data
+    return frame
+
+
+def split_frame(frame: FrameBuffer, led_counts: Sequence[int]) -> List[FrameBuffer]:
+    views = []
+    start = 0
+    for led_count in led_counts:
+        views.append(frame.view(start, led_count))
+        start += led_count
+    return views
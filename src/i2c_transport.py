@@ -0,0 +1,253 @@
+import ctypes
+import fcntl
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from smbus3 import SMBus
+
+logger = logging.getLogger(__name__)
+
+# linux/i2c-dev.h and linux/i2c.h
+I2C_FUNCS = 0x0705
+I2C_RDWR = 0x0707
+I2C_FUNC_I2C = 0x00000001
+I2C_M_RD = 0x0001
+I2C_RDWR_IOCTL_MAX_MSGS = 42
+
+ENE_REGISTER_SELECT = 0x00
+ENE_WRITE_BYTE = 0x01
+ENE_WRITE_BLOCK = 0x03
+ENE_READ_BYTE = 0x81
+
+RegisterBlock = Tuple[int, Sequence[int]]
+Ioctl = Callable[[int, int, Any], Any]
+
+
+class I2CMessage(ctypes.Structure):
+    _fields_ = [
+        ("addr", ctypes.c_uint16),
+        ("flags", ctypes.c_uint16),
+        ("len", ctypes.c_uint16),
+        ("buf", ctypes.POINTER(ctypes.c_uint8)),
+    ]
+
+
+class I2CRdwrIoctlData(ctypes.Structure):
+    _fields_ = [
+        ("msgs", ctypes.POINTER(I2CMessage)),
+        ("nmsgs", ctypes.c_uint32),
+    ]
+
+
+def swap_register(register: int) -> int:
+    return ((register << 8) & 0xFF00) | ((register >> 8) & 0x00FF)
+
+
+class ENETransport(ABC):
+    @abstractmethod
+    def read_registers(self, address: int, registers: Sequence[int]) -> List[int]:
+        pass
+
+    @abstractmethod
+    def write_register(self, address: int, register: int, value: int) -> None:
+        pass
+
+    @abstractmethod
+    def write_register_blocks(self, address: int, blocks: Sequence[RegisterBlock]) -> None:
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+
+class SMBusTransport(ENETransport):
+    def __init__(self, bus_number: int) -> None:
+        self.bus: SMBus = SMBus(bus_number)
+
+    def read_registers(self, address: int, registers: Sequence[int]) -> List[int]:
+        values = []
+        for register in registers:
+            self.bus.write_word_data(address, ENE_REGISTER_SELECT, swap_register(register))
+            values.append(self.bus.read_byte_data(address, ENE_READ_BYTE))
+        return values
+
+    def write_register(self, address: int, register: int, value: int) -> None:
+        self.bus.write_word_data(address, ENE_REGISTER_SELECT, swap_register(register))
+        self.bus.write_byte_data(address, ENE_WRITE_BYTE, value)
+
+    def write_register_blocks(self, address: int, blocks: Sequence[RegisterBlock]) -> None:
+        for register, data in blocks:
+            self.bus.write_word_data(address, ENE_REGISTER_SELECT, swap_register(register))
+            self.bus.write_block_data(address, ENE_WRITE_BLOCK, list(data))
+
+    def close(self) -> None:
+        self.bus.close()
+
+
+class I2CRdwrTransport(ENETransport):
+    def __init__(self, bus_number: int, ioctl: Ioctl = fcntl.ioctl, fd: Optional[int] = None) -> None:
+        self.bus_number: int = bus_number
+        self._ioctl: Ioctl = ioctl
+        self.fd: int = os.open(f"/dev/i2c-{bus_number}", os.O_RDWR) if fd is None else fd
+
+    def supports_i2c(self) -> bool:
+        funcs = ctypes.c_ulong()
+        self._ioctl(self.fd, I2C_FUNCS, funcs)
+        return bool(funcs.value & I2C_FUNC_I2C)
+
+    def read_registers(self, address: int, registers: Sequence[int]) -> List[int]:
+        messages: List[Tuple[int, bytes | int]] = []
+        for register in registers:
+            messages.append((0, bytes([ENE_REGISTER_SELECT, register >> 8, register & 0xFF])))
+            messages.append((0, bytes([ENE_READ_BYTE])))
+            messages.append((I2C_M_RD, 1))
+        return [data[0] for data in self._transfer(address, messages)]
+
+    def write_register(self, address: int, register: int, value: int) -> None:
+        self._transfer(
+            address,
+            [
+                (0, bytes([ENE_REGISTER_SELECT, register >> 8, register & 0xFF])),
+                (0, bytes([ENE_WRITE_BYTE, value])),
+            ],
+        )
+
+    def write_register_blocks(self, address: int, blocks: Sequence[RegisterBlock]) -> None:
+        messages: List[Tuple[int, bytes | int]] = []
+        for register, data in blocks:
+            messages.append((0, bytes([ENE_REGISTER_SELECT, register >> 8, register & 0xFF])))
+            messages.append((0, bytes([ENE_WRITE_BLOCK, len(data), *data])))
+        self._transfer(address, messages)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+    def _transfer(self, address: int, messages: Sequence[Tuple[int, bytes | int]]) -> List[bytes]:
+        # The kernel limit is a multiple of both the 2 and 3 message register accesses, so none gets split.
+        # One ioctl carries 14 register reads or 21 block writes: the 16-byte name read takes 2 ioctls,
+        # the 64-byte config table 5, a color write of up to 21 LEDs 1
+        results: List[bytes] = []
+        for start in range(0, len(messages), I2C_RDWR_IOCTL_MAX_MSGS):
+            results.extend(self._rdwr(address, messages[start : start + I2C_RDWR_IOCTL_MAX_MSGS]))
+        return results
+
+    def _rdwr(self, address: int, messages: Sequence[Tuple[int, bytes | int]]) -> List[bytes]:
+        msgs = (I2CMessage * len(messages))()
+        buffers = []
+        for i, (flags, payload) in enumerate(messages):
+            if flags & I2C_M_RD:
+                assert isinstance(payload, int)
+                buffer = (ctypes.c_uint8 * payload)()
+            else:
+                assert isinstance(payload, bytes)
+                buffer = (ctypes.c_uint8 * len(payload)).from_buffer_copy(payload)
+            buffers.append(buffer)
+            msgs[i] = I2CMessage(address, flags, len(buffer), ctypes.cast(buffer, ctypes.POINTER(ctypes.c_uint8)))
+
+        self._ioctl(self.fd, I2C_RDWR, I2CRdwrIoctlData(msgs, len(messages)))
+
+        return [bytes(buffer) for (flags, _), buffer in zip(messages, buffers) if flags & I2C_M_RD]
+
+
+class RecordingTransport(ENETransport):
+    def __init__(self) -> None:
+        self.operations: List[bytes] = []
+
+    def read_registers(self, address: int, registers: Sequence[int]) -> List[int]:
+        raise RuntimeError("Register reads cannot be recorded")
+
+    def write_register(self, address: int, register: int, value: int) -> None:
+        self.operations.append(bytes([ENE_WRITE_BYTE, register >> 8, register & 0xFF, value]))
+
+    def write_register_blocks(self, address: int, blocks: Sequence[RegisterBlock]) -> None:
+        for register, data in blocks:
+            self.operations.append(bytes([ENE_WRITE_BLOCK, register >> 8, register & 0xFF, *data]))
+
+    def close(self) -> None:
+        pass
+
+
+def replay_operations(transport: ENETransport, address: int, operations: Sequence[bytes]) -> None:
+    blocks: List[RegisterBlock] = []
+    for operation in operations:
+        register = (operation[1] << 8) | operation[2]
+        if operation[0] == ENE_WRITE_BLOCK:
+            blocks.append((register, operation[3:]))
+            continue
+        if blocks:
+            transport.write_register_blocks(address, blocks)
+            blocks = []
+        transport.write_register(address, register, operation[3])
+    if blocks:
+        transport.write_register_blocks(address, blocks)
+
+
+def open_ene_transport(bus_number: int, use_i2c_rdwr: bool = False) -> ENETransport:
+    if use_i2c_rdwr:
+        transport: Optional[I2CRdwrTransport] = None
+        try:
+            transport = I2CRdwrTransport(bus_number)
+            if transport.supports_i2c():
+                logger.debug("Using I2C_RDWR transport on bus %d", bus_number)
+                return transport
+            logger.info("Bus %d does not support plain I2C transfers, falling back to SMBus", bus_number)
+        except OSError as e:
+            logger.warning("Could not open I2C_RDWR transport on bus %d, falling back to SMBus: %s", bus_number, e)
+        if transport is not None:
+            transport.close()
+
+    return SMBusTransport(bus_number)
+
+
+if __name__ == "__main__":
+    # Fake ioctl emulating an ENE chip, to check message encoding and batching without an I2C bus
+    class FakeENEBus:
+        def __init__(self) -> None:
+            self.registers: Dict[int, int] = {}
+            self.selected = 0
+            self.transfers: List[int] = []
+
+        def ioctl(self, _fd: int, request: int, arg: Any) -> None:
+            if request == I2C_FUNCS:
+                arg.value = I2C_FUNC_I2C
+                return
+            assert request == I2C_RDWR
+            assert arg.nmsgs <= I2C_RDWR_IOCTL_MAX_MSGS
+            self.transfers.append(arg.nmsgs)
+            for i in range(arg.nmsgs):
+                message = arg.msgs[i]
+                if message.flags & I2C_M_RD:
+                    message.buf[0] = self.registers.get(self.selected, 0)
+                    continue
+                data = bytes(message.buf[: message.len])
+                if data[0] == ENE_REGISTER_SELECT:
+                    self.selected = (data[1] << 8) | data[2]
+                elif data[0] == ENE_WRITE_BYTE:
+                    self.registers[self.selected] = data[1]
+                elif data[0] == ENE_WRITE_BLOCK:
+                    for offset, value in enumerate(data[2 : 2 + data[1]]):
+                        self.registers[self.selected + offset] = value
+
+    fake_bus = FakeENEBus()
+    fake_transport = I2CRdwrTransport(0, ioctl=fake_bus.ioctl, fd=os.open(os.devnull, os.O_RDWR))
+    print(f"Supports plain I2C: {fake_transport.supports_i2c()}")
+
+    fake_transport.write_register(0x77, 0x8020, 0x01)
+    color_blocks = [(0x8100 + 3 * i, [i, 255 - i, 0]) for i in range(40)]
+    fake_transport.write_register_blocks(0x77, color_blocks)
+    print(f"Messages per transfer: {fake_bus.transfers}")
+
+    read_back = fake_transport.read_registers(0x77, [0x8020] + [register for register, _ in color_blocks])
+    assert read_back == [0x01] + list(range(40)), read_back
+    print(f"Read back {len(read_back)} registers, last color block at 0x{color_blocks[-1][0]:04X}")
+
+    # Three messages per register read, 14 reads per ioctl
+    for length, expected_ioctls in [(16, 2), (64, 5)]:
+        fake_bus.transfers.clear()
+        fake_transport.read_registers(0x77, range(0x1000, 0x1000 + length))
+        assert len(fake_bus.transfers) == expected_ioctls, fake_bus.transfers
+        print(f"Reading {length} registers takes {len(fake_bus.transfers)} ioctls: {fake_bus.transfers}")
+    fake_transport.close()
@@ -1,13 +1,26 @@
 from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
 
+from framebuffer import Colors
 from utils import RGBColor
+from zones import ALL_ZONE, Zone
 
 
 class LEDController(ABC):
+    led_count: int
+
+    @property
+    def device_id(self) -> str:
+        return type(self).__name__
+
     @abstractmethod
     def set_static_color(self, color: RGBColor) -> None:
         pass
 
+    @abstractmethod
+    def set_color(self, colors: Colors) -> None:
+        pass
+
     @abstractmethod
     def turn_on(self) -> None:
         pass
@@ -15,3 +28,32 @@ class LEDController(ABC):
     @abstractmethod
     def turn_off(self) -> None:
         pass
+
+    def zones(self) -> List[Zone]:
+        return [Zone(ALL_ZONE, 0, self.led_count)]
+
+    def set_zone_color(self, zone: str, colors: Colors) -> None:
+        if zone != ALL_ZONE:
+            raise ValueError(f"Unknown zone: {zone}. Valid values: {[z.name for z in self.zones()]}")
+        self.set_color(colors)
+
+    def reconnect(self) -> None:
+        pass
+
+    def keepalive_due(self) -> Optional[float]:
+        return None
+
+    def keepalive(self) -> None:
+        pass
+
+    def scene_key(self) -> Optional[str]:
+        return None
+
+    # Devices without a scene_key() are never compiled, replaying such an entry sets the color directly
+    def compile_static_color(self, color: RGBColor) -> Tuple[List[bytes], bytes]:  # pylint: disable=unused-argument
+        return [], b""
+
+    def replay_static_color(
+        self, color: RGBColor, packets: List[bytes], state: bytes  # pylint: disable=unused-argument
+    ) -> None:
+        self.set_static_color(color)
@@ -1,80 +1,240 @@
 import atexit
 import logging
 import signal
-import sys
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
-from typing import Callable, List
+from typing import Any, Callable, Coroutine, List, Optional
 
+from async_controller import AsyncSyncedRGBController, EventLoopThread
+from audio_reactive import AudioReactiveEffect, open_source
 from aura_device import AsusAuraLedDevice
 from corsair_lighting_node import CorsairLightingNodeController
+from device_supervisor import HotplugMonitor, SupervisedController
 from ene_sync_controller import ENESyncController
+from framebuffer import Colors, FrameBuffer, split_frame
 from led_controller_interface import LEDController
+from metrics import MetricsTextfileExporter, metrics
+from scene_cache import SceneCache
+from service_loop import PowerState, ServiceLoop
+from transition import EASINGS
 from utils import DEFAULT_COLOR, RGBColor
+from zones import Zone
 from device_config import (
+    AUDIO_SOURCE,
+    AURA_COLOR_PROFILE,
+    AURA_TRANSPORT,
+    CORSAIR_COLOR_PROFILE,
+    DEFAULT_SCENE,
+    ENE_USE_I2C_RDWR,
     GPU_BUS_ADDRESS,
     GPU_BUS_NUMBER,
+    GPU_COLOR_PROFILE,
     GPU_DEVICE_NAME,
+    METRICS_EXPORT_INTERVAL,
+    METRICS_TEXTFILE_PATH,
     RAM1_BUS_ADDRESS,
     RAM2_BUS_ADDRESS,
     RAM_BUS_NUMBER,
+    RAM_COLOR_PROFILE,
     RAM_DEVICE_NAME,
+    SCENE_CACHE_DIR,
+    SCENES,
 )
 
 logger = logging.getLogger(__name__)
 
 
-class SyncedRGBController(LEDController):
+# Holds one handle per subsystem (devices, I/O loop, scenes, metrics, audio, service loop), their state is grouped there
+class SyncedRGBController(LEDController):  # pylint: disable=too-many-instance-attributes
+    AUDIO_STOP_TIMEOUT = 1.0
+
     def __init__(self):
-        self.controllers: List[LEDController] = [
-            ENESyncController(
-                [
-                    (RAM_BUS_NUMBER, RAM1_BUS_ADDRESS, RAM_DEVICE_NAME),
-                    (RAM_BUS_NUMBER, RAM2_BUS_ADDRESS, RAM_DEVICE_NAME),
-                    (GPU_BUS_NUMBER, GPU_BUS_ADDRESS, GPU_DEVICE_NAME),
-                ]
+        self.hotplug = HotplugMonitor()
+        self.controllers: List[SupervisedController] = [
+            SupervisedController(
+                ENESyncController(
+                    [
+                        (RAM_BUS_NUMBER, RAM1_BUS_ADDRESS, RAM_DEVICE_NAME, RAM_COLOR_PROFILE),
+                        (RAM_BUS_NUMBER, RAM2_BUS_ADDRESS, RAM_DEVICE_NAME, RAM_COLOR_PROFILE),
+                        (GPU_BUS_NUMBER, GPU_BUS_ADDRESS, GPU_DEVICE_NAME, GPU_COLOR_PROFILE),
+                    ],
+                    ENE_USE_I2C_RDWR,
+                )
+            ),
+            SupervisedController(
+                CorsairLightingNodeController(CORSAIR_COLOR_PROFILE),
+                self.hotplug,
+                (CorsairLightingNodeController.VENDOR_ID, CorsairLightingNodeController.PRODUCT_ID),
+            ),
+            SupervisedController(
+                AsusAuraLedDevice(color_profile=AURA_COLOR_PROFILE, transport=AURA_TRANSPORT),
+                self.hotplug,
+                (AsusAuraLedDevice.VENDOR_ID, AsusAuraLedDevice.PRODUCT_ID),
             ),
-            CorsairLightingNodeController(),
-            AsusAuraLedDevice(),
         ]
-        self.running = False
+        self.led_count: int = sum(controller.led_count for controller in self.controllers)
+        # Shared frame for producers, each device reads its own view of it
+        self.frame: FrameBuffer = FrameBuffer(self.led_count)
+        # Device I/O runs on per-device workers driven from one event loop, callers block on the result
+        self.io = AsyncSyncedRGBController(self.controllers)
+        self.io_loop = EventLoopThread("io-loop")
+        self.scenes = SceneCache(SCENE_CACHE_DIR)
+        self.metrics_exporter = MetricsTextfileExporter(metrics, METRICS_TEXTFILE_PATH, METRICS_EXPORT_INTERVAL)
+        self.audio_effect: Optional[AudioReactiveEffect] = None
+        self._audio_thread: Optional[threading.Thread] = None
+        self.service = ServiceLoop()
         logger.info("Synced RGB Controller initialized")
 
-    def _execute(self, func: Callable, *args, **kwargs) -> None:
-        with ThreadPoolExecutor() as executor:
-            list(executor.map(lambda device: func(device, *args, **kwargs), self.controllers))
+    @property
+    def current_color(self) -> RGBColor:
+        return self.io.current_color
+
+    @current_color.setter
+    def current_color(self, color: RGBColor) -> None:
+        self.io.current_color = color
+
+    def _io(self, coroutine: Coroutine[Any, Any, Any]) -> Any:
+        return self.io_loop.run(coroutine)
 
     def set_static_color(self, color: RGBColor) -> None:
-        self._execute(lambda d, c: d.set_static_color(c), color)
+        self._io(self.io.set_static_color(color))
+        self.service.wake()
+
+    def set_color(self, colors: Colors) -> None:
+        if isinstance(colors, FrameBuffer):
+            if colors.led_count != self.led_count:
+                raise ValueError(f"Frame of {colors.led_count} LEDs does not match the {self.led_count} synced LEDs")
+            self.push_frame(colors)
+            return
+        self._io(self.io.set_color(colors))
+        self.service.wake()
+
+    def push_frame(self, frame: Optional[FrameBuffer] = None, timeout: Optional[float] = None) -> None:
+        # With a timeout, devices that are still busy or miss the deadline skip this frame
+        deadline = None if timeout is None else self.io_loop.time() + timeout
+        self._io(self.io.push_frame(self.frame if frame is None else frame, deadline))
+        # Producers wake the service loop once when they finish, not on every frame
+        if self.service.power_state is PowerState.IDLE:
+            self.service.wake()
+
+    def zones(self) -> List[Zone]:
+        # Zones of every device as "device.zone", positioned in the shared frame
+        zones = []
+        view_start = 0
+        for controller in self.controllers:
+            for zone in controller.zones():
+                zones.append(Zone(f"{controller.device_id}.{zone.name}", view_start + zone.start, zone.led_count))
+            view_start += controller.led_count
+        return zones
+
+    def set_zone_color(self, zone: str, colors: Colors) -> None:
+        device_id, _, device_zone = zone.partition(".")
+        if device_id not in [controller.device_id for controller in self.controllers]:
+            raise ValueError(f"Unknown zone: {zone}. Valid values: {[z.name for z in self.zones()]}")
+        self._io(self.io.set_zone_color(device_id, device_zone or None, colors))
+        self.service.wake()
+
+    def transition_to(self, color: RGBColor, duration: float, easing: str = "ease_in_out") -> None:
+        if easing not in EASINGS:
+            raise ValueError(f"Unknown easing: {easing}. Valid values: {list(EASINGS)}")
+        with metrics.track(self.device_id, "transition"), self.service.animating():
+            self._io(self.io.transition_to(color, duration, easing))
+
+    def apply_scene(self, name: str) -> None:
+        if name not in SCENES:
+            raise ValueError(f"Unknown scene: {name}. Valid values: {list(SCENES)}")
+        color = SCENES[name]
+        self._io(self.io.call_each("apply_scene", self.scenes.apply_device, name, color))
+        self.scenes.save(name)
+        self.current_color = color
+        self.service.wake()
 
-    def set_color(self, colors: RGBColor | List[RGBColor]) -> None:
-        self._execute(lambda d, c: d.set_color(c), colors)
+    def start_audio_reactive(self, source: str) -> None:
+        self.stop_audio_reactive()
+        pcm_source = open_source(source)
+        try:
+            effect = AudioReactiveEffect(
+                pcm_source,
+                split_frame(self.frame, [c.led_count for c in self.controllers]),
+                lambda timeout: self.push_frame(timeout=timeout),
+                realtime=True,
+            )
+        except Exception:
+            pcm_source.close()
+            raise
+
+        def run() -> None:
+            with self.service.animating():
+                effect.run()
+
+        self.audio_effect = effect
+        self._audio_thread = threading.Thread(target=run, name="audio-reactive", daemon=True)
+        self._audio_thread.start()
+
+    def stop_audio_reactive(self) -> None:
+        if self.audio_effect is None or self._audio_thread is None:
+            return
+        self.audio_effect.stop()
+        # A frame already being pushed has to land before the caller turns the devices off
+        self._audio_thread.join(self.AUDIO_STOP_TIMEOUT)
+        if self._audio_thread.is_alive():
+            logger.warning("Audio reactive thread is still blocked reading its source")
+        self.audio_effect = None
+        self._audio_thread = None
 
     def turn_on(self) -> None:
-        self._execute(lambda d: d.turn_on())
+        self._io(self.io.turn_on())
+        self.current_color = DEFAULT_COLOR
+        self.service.wake()
 
     def turn_off(self) -> None:
-        self._execute(lambda d: d.turn_off())
+        self._io(self.io.turn_off())
+        self.service.wake()
+
+    @property
+    def device_id(self) -> str:
+        return "synced"
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> None:
+        self.service.schedule(delay, callback)
 
     def run(self) -> None:
-        self.running = True
+        self.service.start()
+        self.metrics_exporter.start()
+        self.hotplug.start()
         try:
             self.turn_on()
             logger.info("RGB Controller service running")
             time.sleep(1)
 
-            self.set_static_color(DEFAULT_COLOR)
+            self.apply_scene(DEFAULT_SCENE)
+            if AUDIO_SOURCE is not None:
+                try:
+                    self.start_audio_reactive(AUDIO_SOURCE)
+                except Exception as e:
+                    logger.error("Audio reactive mode unavailable: %s", e)
 
-            signal.pause()
+            self.service.serve(self.controllers)
 
         except Exception as e:
             logger.error("Error in main loop: %s", e)
             raise
 
+    def request_stop(self) -> None:
+        # Only ends the service loop, safe from a signal handler: device and metrics locks may be held by the
+        # frame the signal interrupted
+        self.service.stop()
+
     def stop(self) -> None:
         logger.info("Stopping RGB Controller service")
-        self.running = False
+        self.request_stop()
+        self.stop_audio_reactive()
         self.turn_off()
+        self.io.close()
+        self.io_loop.stop()
+        for controller in self.controllers:
+            controller.stop()
+        self.metrics_exporter.stop()
 
 
 def main():
@@ -84,8 +244,8 @@ def main():
 
     def signal_handler(signum=None, _frame=None):
         logger.info("Received signal %s, shutting down...", signum)
-        _cleanup()
-        sys.exit(0)
+        # The devices are turned off once run() returned, not from inside the interrupted frame
+        controller.request_stop()
 
     def _cleanup():
         nonlocal closed, controller
@@ -104,6 +264,8 @@ def main():
         logger.info("Keyboard interrupt received")
     except Exception as e:
         logger.error("Fatal error: %s", e)
+    finally:
+        _cleanup()
 
 
 if __name__ == "__main__":
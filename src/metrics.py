@@ -0,0 +1,214 @@
+import logging
+import os
+import resource
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets, last bucket is +Inf
+LATENCY_BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+METRIC_PREFIX = "my_pc_rgb"
+
+
+class Histogram:
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self) -> None:
+        self.buckets: List[int] = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: str) -> str:
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+def _render_counter(
+    name: str, description: str, label_names: Tuple[str, ...], values: Iterable[Tuple[Tuple[str, ...], int]]
+) -> List[str]:
+    name = f"{METRIC_PREFIX}_{name}"
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+    for key, value in sorted(values):
+        lines.append(f"{name}{_labels(**dict(zip(label_names, key)))} {value}")
+    return lines
+
+
+def _render_histogram(
+    name: str, description: str, histograms: Dict[Tuple[str, str], Tuple[List[int], float, int]]
+) -> List[str]:
+    name = f"{METRIC_PREFIX}_{name}"
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+    for (device, operation), (buckets, total, count) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, bucket in zip(LATENCY_BUCKETS + (float("inf"),), buckets):
+            cumulative += bucket
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{name}_bucket{_labels(device=device, operation=operation, le=le)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(device=device, operation=operation)} {total}")
+        lines.append(f"{name}_count{_labels(device=device, operation=operation)} {count}")
+    return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._operations: Dict[Tuple[str, str], int] = {}
+        self._durations: Dict[Tuple[str, str], Histogram] = {}
+        self._errors: Dict[Tuple[str, str, str], int] = {}
+        self._retries: Dict[Tuple[str, str], int] = {}
+        self._bytes_sent: Dict[str, int] = {}
+        self.changed = threading.Event()
+
+    def observe(
+        self, device: str, operation: str, duration: float, bytes_sent: int = 0, error: Optional[str] = None
+    ) -> None:
+        key = (device, operation)
+        with self._lock:
+            self._operations[key] = self._operations.get(key, 0) + 1
+            histogram = self._durations.get(key)
+            if histogram is None:
+                histogram = self._durations[key] = Histogram()
+            histogram.observe(duration)
+            if bytes_sent:
+                self._bytes_sent[device] = self._bytes_sent.get(device, 0) + bytes_sent
+            if error is not None:
+                error_key = (device, operation, error)
+                self._errors[error_key] = self._errors.get(error_key, 0) + 1
+        self.changed.set()
+
+    def record_error(self, device: str, operation: str, error: str) -> None:
+        key = (device, operation, error)
+        with self._lock:
+            self._errors[key] = self._errors.get(key, 0) + 1
+        self.changed.set()
+
+    def record_retry(self, device: str, operation: str) -> None:
+        key = (device, operation)
+        with self._lock:
+            self._retries[key] = self._retries.get(key, 0) + 1
+        self.changed.set()
+
+    @contextmanager
+    def track(self, device: str, operation: str, bytes_sent: int = 0) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.observe(device, operation, time.perf_counter() - start, error=type(e).__name__)
+            raise
+        self.observe(device, operation, time.perf_counter() - start, bytes_sent)
+
+    def render(self) -> str:
+        with self._lock:
+            operations = dict(self._operations)
+            durations = {key: (list(h.buckets), h.sum, h.count) for key, h in self._durations.items()}
+            errors = dict(self._errors)
+            retries = dict(self._retries)
+            bytes_sent = dict(self._bytes_sent)
+
+        lines: List[str] = []
+        lines += _render_counter(
+            "operations_total", "Number of device operations.", ("device", "operation"), operations.items()
+        )
+        lines += _render_counter(
+            "operation_errors_total",
+            "Number of failed device operations.",
+            ("device", "operation", "error"),
+            errors.items(),
+        )
+        lines += _render_counter(
+            "operation_retries_total", "Number of retried device operations.", ("device", "operation"), retries.items()
+        )
+        lines += _render_counter(
+            "bytes_sent_total",
+            "Number of bytes sent to the device.",
+            ("device",),
+            [((device,), value) for device, value in bytes_sent.items()],
+        )
+        lines += _render_histogram("operation_duration_seconds", "Device operation latency.", durations)
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(self.render())
+        os.replace(tmp_path, path)
+
+
+class ResourceUsage(NamedTuple):
+    time: float
+    cpu_time: float
+    context_switches: int
+
+    @classmethod
+    def sample(cls) -> "ResourceUsage":
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return cls(time.monotonic(), usage.ru_utime + usage.ru_stime, usage.ru_nvcsw + usage.ru_nivcsw)
+
+    def rates_since(self, earlier: "ResourceUsage") -> Tuple[float, float]:
+        # Every context switch of the process is a thread blocking or being woken, so they approximate wakeups
+        elapsed = max(self.time - earlier.time, 1e-9)
+        return (self.context_switches - earlier.context_switches) / elapsed, (
+            self.cpu_time - earlier.cpu_time
+        ) / elapsed
+
+
+class MetricsTextfileExporter:
+    def __init__(self, registry: MetricsRegistry, path: str, interval: float) -> None:
+        self.registry: MetricsRegistry = registry
+        self.path: str = path
+        self.interval: float = interval
+        self.thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        if self.thread:
+            return
+        self._stopped.clear()
+        self.thread = threading.Thread(target=self._run, name="metrics-exporter", daemon=True)
+        self.thread.start()
+        logger.info("Exporting metrics to %s", self.path)
+
+    def stop(self) -> None:
+        if not self.thread:
+            return
+        self._stopped.set()
+        self.registry.changed.set()
+        self.thread.join()
+        self.thread = None
+        self._export()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            # Blocks without waking up until something was recorded
+            self.registry.changed.wait()
+            if self._stopped.is_set():
+                break
+            self.registry.changed.clear()
+            self._export()
+            self._stopped.wait(self.interval)
+
+    def _export(self) -> None:
+        try:
+            self.registry.write_textfile(self.path)
+        except OSError as e:
+            logger.error("Failed to write metrics to %s: %s", self.path, e)
+
+
+metrics = MetricsRegistry()
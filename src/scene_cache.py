@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import os
+import re
+import struct
+import threading
+from typing import Dict, List, NamedTuple, Set
+
+from led_controller_interface import LEDController
+from utils import RGBColor
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"RGBS"
+FORMAT_VERSION = 1
+DIGEST_SIZE = 16
+SCENE_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class SceneEntry(NamedTuple):
+    device_id: str
+    state: bytes
+    packets: List[bytes]
+
+
+def scene_digest(name: str, color: RGBColor, scene_key: str) -> bytes:
+    data = f"{FORMAT_VERSION}|{name}|{color}|{scene_key}".encode()
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
+def encode_scene(entries: Dict[bytes, SceneEntry]) -> bytes:
+    buffer = bytearray(MAGIC)
+    buffer += struct.pack("<BH", FORMAT_VERSION, len(entries))
+    for digest, entry in entries.items():
+        encoded_id = entry.device_id.encode()
+        buffer += struct.pack("<B", len(encoded_id)) + encoded_id
+        buffer += digest
+        buffer += struct.pack("<B", len(entry.state)) + entry.state
+        buffer += struct.pack("<H", len(entry.packets))
+        for packet in entry.packets:
+            # Packets are mostly zero padding, only the payload is stored
+            payload = packet.rstrip(b"\x00")
+            buffer += struct.pack("<BB", len(packet), len(payload)) + payload
+    return bytes(buffer)
+
+
+def decode_scene(data: bytes) -> Dict[bytes, SceneEntry]:
+    if data[: len(MAGIC)] != MAGIC:
+        raise ValueError("Invalid scene file magic")
+    offset = len(MAGIC)
+    version, entry_count = struct.unpack_from("<BH", data, offset)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported scene file version {version}, expected {FORMAT_VERSION}")
+    offset += 3
+
+    entries: Dict[bytes, SceneEntry] = {}
+    for _ in range(entry_count):
+        id_length = data[offset]
+        device_id = data[offset + 1 : offset + 1 + id_length].decode()
+        offset += 1 + id_length
+        digest = data[offset : offset + DIGEST_SIZE]
+        offset += DIGEST_SIZE
+        state_length = data[offset]
+        state = data[offset + 1 : offset + 1 + state_length]
+        offset += 1 + state_length
+        (packet_count,) = struct.unpack_from("<H", data, offset)
+        offset += 2
+
+        packets: List[bytes] = []
+        for _ in range(packet_count):
+            packet_length, payload_length = struct.unpack_from("<BB", data, offset)
+            offset += 2
+            payload = data[offset : offset + payload_length]
+            offset += payload_length
+            packets.append(payload + b"\x00" * (packet_length - payload_length))
+
+        entries[digest] = SceneEntry(device_id, state, packets)
+    return entries
+
+
+class SceneCache:
+    def __init__(self, directory: str) -> None:
+        self.directory: str = directory
+        # Entries are keyed by digest, a device keeps one entry per state it was compiled from
+        self._scenes: Dict[str, Dict[bytes, SceneEntry]] = {}
+        # Digests applied during this run, only these are written back so stale states do not pile up
+        self._used: Dict[str, Set[bytes]] = {}
+        # Scenes with entries compiled since they were last saved
+        self._dirty: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def apply_device(self, controller: LEDController, name: str, color: RGBColor) -> None:
+        # Runs on the device's own I/O worker, devices of one scene are applied concurrently
+        scene_key = controller.scene_key()
+        if scene_key is None:
+            controller.set_static_color(color)
+            return
+
+        device_id = controller.device_id
+        entries = self._entries(name)
+        digest = scene_digest(name, color, scene_key)
+        entry = entries.get(digest)
+        if entry is None:
+            try:
+                packets, state = controller.compile_static_color(color)
+            except Exception as e:
+                logger.error("Could not compile scene %s for %s: %s", name, device_id, e)
+                controller.set_static_color(color)
+                return
+            entry = SceneEntry(device_id, state, packets)
+            with self._lock:
+                entries[digest] = entry
+                self._dirty.add(name)
+            logger.debug("Compiled scene %s for %s into %d packets", name, device_id, len(packets))
+
+        with self._lock:
+            self._used.setdefault(name, set()).add(digest)
+        controller.replay_static_color(color, entry.packets, entry.state)
+
+    def save(self, name: str) -> None:
+        with self._lock:
+            if name not in self._dirty:
+                return
+            self._dirty.discard(name)
+            used = self._used.get(name, set())
+            entries = {digest: entry for digest, entry in self._scenes[name].items() if digest in used}
+        self._save(name, entries)
+
+    def _entries(self, name: str) -> Dict[bytes, SceneEntry]:
+        if not SCENE_NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid scene name: {name}")
+        with self._lock:
+            entries = self._scenes.get(name)
+            if entries is None:
+                entries = self._scenes[name] = self._load(name)
+            return entries
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.scene")
+
+    def _load(self, name: str) -> Dict[bytes, SceneEntry]:
+        try:
+            with open(self._path(name), "rb") as file:
+                return decode_scene(file.read())
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, struct.error, UnicodeDecodeError) as e:
+            logger.warning("Discarding unreadable scene cache %s: %s", name, e)
+            return {}
+
+    def _save(self, name: str, entries: Dict[bytes, SceneEntry]) -> None:
+        path = self._path(name)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(encode_scene(entries))
+            os.replace(tmp_path, path)
+            logger.debug("Saved scene cache %s", path)
+        except OSError as e:
+            logger.error("Failed to save scene cache %s: %s", path, e)
@@ -0,0 +1,111 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+from led_controller_interface import LEDController
+from metrics import ResourceUsage, metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PowerState(IntEnum):
+    IDLE = 0
+    ACTIVE = 1
+
+
+class ServiceLoop:
+    def __init__(self) -> None:
+        self.running = False
+        # Idle means no producer is changing frames, the loop then only wakes for commands,
+        # scheduled events and device keepalives
+        self.power_state: PowerState = PowerState.IDLE
+        # Reentrant, so stop() may notify from a signal handler that interrupted a locked section
+        self._wake = threading.Condition()
+        self._active_producers = 0
+        self._scheduled: List[Tuple[float, int, Callable[[], None]]] = []
+        self._schedule_order = itertools.count()
+        self._usage: ResourceUsage = ResourceUsage.sample()
+
+    def start(self) -> None:
+        self.running = True
+
+    def stop(self) -> None:
+        self.running = False
+        self.wake()
+
+    def wake(self) -> None:
+        with self._wake:
+            self._wake.notify()
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> None:
+        with self._wake:
+            heapq.heappush(self._scheduled, (time.monotonic() + delay, next(self._schedule_order), callback))
+            self._wake.notify()
+
+    @contextmanager
+    def animating(self) -> Iterator[None]:
+        with self._wake:
+            self._active_producers += 1
+            self._update_power_state()
+        try:
+            yield
+        finally:
+            with self._wake:
+                self._active_producers -= 1
+                self._update_power_state()
+                self._wake.notify()
+
+    def serve(self, controllers: Sequence[LEDController]) -> None:
+        while self.running:
+            with self._wake:
+                timeout = self._next_wakeup(controllers)
+                if timeout is None or timeout > 0:
+                    self._wake.wait(timeout)
+            if self.running:
+                self._run_due(controllers)
+
+    def _update_power_state(self) -> None:
+        power_state = PowerState.ACTIVE if self._active_producers else PowerState.IDLE
+        if power_state is self.power_state:
+            return
+        usage = ResourceUsage.sample()
+        wakeups, cpu = usage.rates_since(self._usage)
+        logger.info(
+            "%s for %.1fs: %.2f wakeups/s, %.3f%% CPU",
+            self.power_state.name.lower(),
+            usage.time - self._usage.time,
+            wakeups,
+            cpu * 100,
+        )
+        self.power_state = power_state
+        self._usage = usage
+
+    def _next_wakeup(self, controllers: Sequence[LEDController]) -> Optional[float]:
+        deadlines = [c.keepalive_due() for c in controllers]
+        if self._scheduled:
+            deadlines.append(self._scheduled[0][0] - time.monotonic())
+        pending = [deadline for deadline in deadlines if deadline is not None]
+        return max(0.0, min(pending)) if pending else None
+
+    def _run_due(self, controllers: Sequence[LEDController]) -> None:
+        now = time.monotonic()
+        due: List[Callable[[], None]] = []
+        with self._wake:
+            while self._scheduled and self._scheduled[0][0] <= now:
+                due.append(heapq.heappop(self._scheduled)[2])
+        for callback in due:
+            try:
+                callback()
+            except Exception as e:
+                logger.error("Scheduled event failed: %s", e)
+
+        for controller in controllers:
+            keepalive_due = controller.keepalive_due()
+            if keepalive_due is not None and keepalive_due <= 0:
+                with metrics.track(controller.device_id, "keepalive"):
+                    controller.keepalive()
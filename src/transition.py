@@ -0,0 +1,131 @@
+import logging
+import threading
+from typing import Callable, Dict, NamedTuple, Optional, TypeAlias
+
+from utils import RGBColor
+
+logger = logging.getLogger(__name__)
+
+Easing: TypeAlias = Callable[[float], float]
+
+
+def linear(progress: float) -> float:
+    return progress
+
+
+def ease_in(progress: float) -> float:
+    return progress * progress
+
+
+def ease_out(progress: float) -> float:
+    return 1 - (1 - progress) * (1 - progress)
+
+
+def ease_in_out(progress: float) -> float:
+    return progress * progress * (3 - 2 * progress)
+
+
+EASINGS: Dict[str, Easing] = {
+    "linear": linear,
+    "ease_in": ease_in,
+    "ease_out": ease_out,
+    "ease_in_out": ease_in_out,
+}
+
+
+def interpolate(start: RGBColor, end: RGBColor, progress: float) -> RGBColor:
+    progress = max(0.0, min(1.0, progress))
+    r0, g0, b0 = start
+    r1, g1, b1 = end
+    return (
+        round(r0 + (r1 - r0) * progress),
+        round(g0 + (g1 - g0) * progress),
+        round(b0 + (b1 - b0) * progress),
+    )
+
+
+class LatencyEstimator:
+    SMOOTHING = 0.3
+
+    def __init__(self, initial: float) -> None:
+        self.initial: float = initial
+        self._estimates: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: float | None = None) -> float:
+        with self._lock:
+            return self._estimates.get(key, self.initial if default is None else default)
+
+    def update(self, key: str, sample: float) -> float:
+        with self._lock:
+            previous = self._estimates.get(key)
+            estimate = sample if previous is None else previous + (sample - previous) * self.SMOOTHING
+            self._estimates[key] = estimate
+            return estimate
+
+
+class Fade(NamedTuple):
+    start_color: RGBColor
+    target_color: RGBColor
+    start_time: float
+    end_time: float
+    easing: Easing
+
+    def color_at(self, now: float) -> RGBColor:
+        progress = (now - self.start_time) / (self.end_time - self.start_time)
+        return interpolate(self.start_color, self.target_color, self.easing(progress))
+
+
+class DeviceTransition:
+    # Stepping rules of one device's part of a fade, the caller does the waiting and sending on its own clock
+    def __init__(self, engine: "TransitionEngine", device_id: str, fade: Fade) -> None:
+        self.engine: "TransitionEngine" = engine
+        self.device_id: str = device_id
+        self.fade: Fade = fade
+        self.last_color: RGBColor = fade.start_color
+        self.steps = 0
+
+    def step_color(self, now: float) -> Optional[RGBColor]:
+        if self.fade.end_time <= self.fade.start_time:
+            return None
+        latency = self.engine.step_latency.get(self.device_id)
+        # Stop stepping once there is no room left for the final update to land on time
+        if now + latency + self.engine.final_latency.get(self.device_id, latency) >= self.fade.end_time:
+            return None
+        # Aim for the color that should be visible once this send completes
+        return self.fade.color_at(now + latency)
+
+    def step_sent(self, color: RGBColor, started: float, finished: float) -> None:
+        self.engine.step_latency.update(self.device_id, finished - started)
+        self.last_color = color
+        self.steps += 1
+
+    def next_step_time(self, started: float) -> float:
+        return started + max(self.engine.step_latency.get(self.device_id), self.engine.MIN_STEP_INTERVAL)
+
+    def final_start_time(self) -> float:
+        # The final update goes through the persistent path, started early enough to finish with the others
+        step_latency = self.engine.step_latency.get(self.device_id)
+        return self.fade.end_time - self.engine.final_latency.get(self.device_id, step_latency)
+
+    def final_sent(self, started: float, finished: float) -> None:
+        self.engine.final_latency.update(self.device_id, finished - started)
+        self.steps += 1
+
+
+class TransitionEngine:
+    INITIAL_LATENCY = 0.02
+    MIN_STEP_INTERVAL = 1 / 60
+
+    def __init__(self) -> None:
+        self.step_latency = LatencyEstimator(self.INITIAL_LATENCY)
+        self.final_latency = LatencyEstimator(self.INITIAL_LATENCY)
+
+    @staticmethod
+    def fade(
+        start_color: RGBColor, target_color: RGBColor, start_time: float, duration: float, easing: Easing = ease_in_out
+    ) -> Fade:
+        return Fade(start_color, target_color, start_time, start_time + max(0.0, duration), easing)
+
+    def device_transition(self, device_id: str, fade: Fade) -> DeviceTransition:
+        return DeviceTransition(self, device_id, fade)
@@ -9,6 +9,10 @@ CommandData: TypeAlias = str | bytes | bytearray | List[int]
 logger = logging.getLogger(__name__)
 
 
+class DeviceUnavailableError(RuntimeError):
+    pass
+
+
 def _convert_to_bytes(data: CommandData) -> bytes:
     if isinstance(data, str):
         return bytes.fromhex(data.replace(" ", ""))
@@ -0,0 +1,31 @@
+from typing import List, NamedTuple, Sequence
+
+from framebuffer import Colors, FrameBuffer, copy_colors
+
+ALL_ZONE = "all"
+
+
+class Zone(NamedTuple):
+    name: str
+    start: int
+    led_count: int
+
+
+def find_zone(zones: Sequence[Zone], name: str) -> Zone:
+    for zone in zones:
+        if zone.name == name:
+            return zone
+    raise ValueError(f"Unknown zone: {name}. Valid values: {[zone.name for zone in zones]}")
+
+
+def contiguous_zones(names: Sequence[str], led_counts: Sequence[int]) -> List[Zone]:
+    zones = []
+    start = 0
+    for name, led_count in zip(names, led_counts):
+        zones.append(Zone(name, start, led_count))
+        start += led_count
+    return zones
+
+
+def write_zone(frame: FrameBuffer, zone: Zone, colors: Colors) -> FrameBuffer:
+    return copy_colors(frame.view(zone.start, zone.led_count), colors)